@@ -0,0 +1,140 @@
+import datetime
+import io
+import time
+import tracemalloc
+from collections import namedtuple, OrderedDict
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import DateTimeField, DurationField, ExpressionWrapper, F, Max, Value
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from .models import Document
+
+
+Result = namedtuple('Result', ('name', 'p50', 'p90', 'p99', 'queries', 'peak_memory'))
+
+EXPIRY_DAYS = 30
+
+
+def percentile(values, p):
+    values = sorted(values)
+    index = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[index]
+
+
+def measure(name, func, iterations, setup=None):
+    timings = []
+    queries = []
+
+    for _ in range(iterations):
+        args = setup() if setup else ()
+
+        with CaptureQueriesContext(connection) as context:
+            start = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - start)
+
+        queries.append(len(context.captured_queries))
+
+    # memory is traced in a separate run, so that tracing does not distort the timings
+    args = setup() if setup else ()
+    tracemalloc.start()
+    try:
+        func(*args)
+        _, peak_memory = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return Result(name, percentile(timings, 50), percentile(timings, 90), percentile(timings, 99),
+                  max(queries), peak_memory)
+
+
+def seed(rows, deleted_ratio=0.1):
+    user = User.objects.create(username='benchmark')
+
+    now = timezone.now()
+    step = datetime.timedelta(days=2 * EXPIRY_DAYS) / rows
+
+    documents = [Document(user=user, title='document %d' % i, text='text ' * 100,
+                          deleted=(i % int(1 / deleted_ratio) == 0))
+                 for i in range(rows)]
+    Document.objects.bulk_create(documents)
+
+    # spread the modification timestamps over twice the expiry delay, oldest first, in a single update
+    last_pk = Document.objects.filter(user=user).aggregate(last_pk=Max('pk'))['last_pk']
+    offset = last_pk + 1 - F('pk')
+
+    if connection.features.has_native_duration_field:
+        delta = offset * Value(step, output_field=DurationField())
+    else:
+        # durations are stored as microseconds
+        delta = offset * (step // datetime.timedelta(microseconds=1))
+
+    delta = ExpressionWrapper(delta, output_field=DurationField())
+    Document.objects.filter(user=user).update(
+        updated=ExpressionWrapper(Value(now, output_field=DateTimeField()) - delta, output_field=DateTimeField()))
+
+    return user
+
+
+def run(rows, iterations):
+    # the deleted limit sits below the seeded deleted documents, so that destroys evict and polls check watermarks
+    limits = {'auth.User': {'api.Document': (rows * 2, max(1, rows // 20))}}
+
+    with override_settings(REST_OFFLINESYNC={'DELETED_EXPIRY_DAYS': EXPIRY_DAYS, 'OBJECT_LIMITS': limits}):
+        user = seed(rows)
+
+        client = APIClient()
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        timestamps = list(Document.objects.order_by('updated').values_list('updated', flat=True))
+
+        def since(fraction):
+            return {'since': timestamps[int(len(timestamps) * (1 - fraction))].isoformat()}
+
+        def create_active():
+            return Document.objects.create(user=user, title='benchmark', text='text'),
+
+        def create_expired():
+            expired = timezone.now() - datetime.timedelta(days=EXPIRY_DAYS + 1)
+            Document.objects.bulk_create([Document(user=user, title='expired', text='text', deleted=True)
+                                          for _ in range(max(1, rows // 10))])
+            Document.objects.filter(title='expired').update(updated=expired)
+            return ()
+
+        scenarios = OrderedDict((
+            ('list (full)', lambda: client.get(base_url)),
+            ('list (since 1%)', lambda: client.get(base_url, since(0.01))),
+            ('list (since 10%)', lambda: client.get(base_url, since(0.1))),
+            ('create', lambda: client.post(base_url, {'user': user.id, 'title': 'benchmark', 'text': 'text'})),
+        ))
+
+        results = [measure(name, func, iterations) for name, func in scenarios.items()]
+
+        results.append(measure('destroy', lambda document: client.delete(base_url + '%d/' % document.id),
+                               iterations, create_active))
+
+        # measured after the destroys, which evict deleted documents and record the eviction watermark
+        results.append(measure('deleted (since 10%)', lambda: client.get(base_url + 'deleted/', since(0.1)),
+                               iterations))
+
+        results.append(measure('cleardeleted', lambda: call_command('cleardeleted', stdout=io.StringIO()),
+                               iterations, create_expired))
+
+    return results
+
+
+def format_results(results):
+    lines = ['%-24s %10s %10s %10s %8s %12s' % ('scenario', 'p50 (ms)', 'p90 (ms)', 'p99 (ms)', 'queries', 'memory (KB)')]
+
+    for result in results:
+        lines.append('%-24s %10.2f %10.2f %10.2f %8d %12.1f' % (result.name, result.p50 * 1000, result.p90 * 1000,
+                                                               result.p99 * 1000, result.queries,
+                                                               result.peak_memory / 1024))
+
+    return '\n'.join(lines)
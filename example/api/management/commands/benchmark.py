@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.db import connections
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from api import benchmarks
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the synchronization endpoints on a seeded test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=10000, help='number of seeded documents')
+        parser.add_argument('--iterations', type=int, default=20, help='number of measured requests per scenario')
+        parser.add_argument('--database', default='default', help='database alias to benchmark')
+        parser.add_argument('--keepdb', action='store_true', help='preserve the test database between runs')
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+
+        setup_test_environment(debug=False)
+        old_name = connection.creation.create_test_db(verbosity=options['verbosity'], keepdb=options['keepdb'])
+
+        try:
+            results = benchmarks.run(options['rows'], options['iterations'])
+
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=options['verbosity'], keepdb=options['keepdb'])
+            teardown_test_environment()
+
+        self.stdout.write('%s, %d rows' % (connection.vendor, options['rows']))
+        self.stdout.write(benchmarks.format_results(results))
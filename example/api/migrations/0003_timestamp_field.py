@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 18:40
+from __future__ import unicode_literals
+
+from django.db import migrations
+import rest_offlinesync.models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0002_sync_indexes'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='document',
+            name='updated',
+            field=rest_offlinesync.models.TimestampField(auto_now=True),
+        ),
+    ]
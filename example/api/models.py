@@ -1,5 +1,5 @@
 from django.db import models
-from rest_offlinesync.models import TrackedModel
+from rest_offlinesync.models import TrackedModel, sync_indexes
 
 
 class Document(TrackedModel):
@@ -7,3 +7,10 @@ class Document(TrackedModel):
 
     title = models.CharField(max_length=128)
     text = models.TextField(max_length=2048)
+
+    change_scope = 'user_id'
+    compacted_fields = ('text',)
+    change_log = True
+
+    class Meta(TrackedModel.Meta):
+        indexes = sync_indexes('user')
@@ -1,9 +1,36 @@
+import json
+import datetime
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.db import connection, models
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
+from django.utils import timezone
 from django.contrib.auth.models import User
-from rest_framework.test import APITestCase
-from rest_framework import status
+from rest_framework.test import APIRequestFactory, APITestCase, APITransactionTestCase
+from rest_framework import mixins, permissions, serializers, status, viewsets
+from rest_offlinesync.paginate import SyncCursorPagination
+from rest_offlinesync.checks import check_sync_indexes
+from rest_offlinesync.conf import get_config
+from rest_offlinesync.models import ChildCounter, EvictionWatermark, Tombstone, ChangeLogEntry, WriteLockedQuerySet, \
+    write_locked
+from rest_offlinesync import changes, clock, feed, instrument, limit, nest
 
+from . import benchmarks
 from .models import Document
+from .serializers import DocumentSerializer
+from .views import DocumentViewSet
+
+
+def get_replay_timestamp(using):
+    return timezone.now()
 
 
 class TestDocuments(APITestCase):
@@ -16,3 +43,771 @@ class TestDocuments(APITestCase):
 
         response = self.client.get(base_url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    @mock.patch.object(SyncCursorPagination, 'page_size', 2)
+    def test_list_cursor(self):
+        user = User.objects.create(username='test', password='test')
+        for i in range(3):
+            Document.objects.create(user=user, title='test%d' % i, text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        response = self.client.get(base_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([doc['title'] for doc in response.data['results']], ['test0', 'test1'])
+        self.assertIsNotNone(response.data['next'])
+
+        until = response.data['until']
+        document = Document.objects.get(title='test0')
+        document.title = 'test3'
+        document.save()
+        Document.objects.create(user=user, title='test4', text='test')
+
+        response = self.client.get(response.data['next'])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([doc['title'] for doc in response.data['results']], ['test2'])
+        self.assertEqual(response.data['until'], until)
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(base_url, {'cursor': 'invalid'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        cursor = SyncCursorPagination().encode_cursor((timezone.now(), 'abc'))
+        response = self.client.get(base_url, {'cursor': cursor})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_sync_indexes(self):
+        self.assertEqual(check_sync_indexes(None), [])
+
+        indexes = Document._meta.indexes + [models.Index(fields=['-created'], name='api_document_created_idx')]
+        with mock.patch.object(Document._meta, 'indexes', indexes):
+            self.assertEqual(check_sync_indexes(None), [])
+
+    @mock.patch.object(DocumentViewSet, 'stream_chunk_size', 2)
+    def test_list_streamed(self):
+        user = User.objects.create(username='test', password='test')
+        for i in range(3):
+            Document.objects.create(user=user, title='test%d' % i, text='test', deleted=(i == 2))
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        response = self.client.get(base_url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        data = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual(list(data), ['since', 'until', 'results'])
+        self.assertEqual(sorted(doc['title'] for doc in data['results']), ['test0', 'test1'])
+
+        response = self.client.get(base_url + 'deleted/')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+        data = json.loads(b''.join(response.streaming_content).decode())
+        self.assertEqual([doc['title'] for doc in data['results']], ['test2'])
+
+    def test_list_conditional(self):
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        with mock.patch.object(DocumentViewSet, 'conditional_list', True):
+            response = self.client.get(base_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            etag = response['ETag']
+
+            with self.assertNumQueries(2):
+                response = self.client.get(base_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+            self.assertEqual(response['ETag'], etag)
+
+            response = self.client.get(base_url, {'since': document.updated.isoformat()}, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            document.save()
+
+            response = self.client.get(base_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotEqual(response['ETag'], etag)
+            etag = response['ETag']
+
+            document.deleted = True
+            document.save()
+
+            response = self.client.get(base_url, HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['results'], [])
+
+            response = self.client.get(base_url + 'deleted/')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+            response = self.client.get(base_url + 'deleted/', HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_wait(self):
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username}) + 'wait/'
+        since = {'since': (document.updated + datetime.timedelta(microseconds=1)).isoformat(), 'timeout': 0.01}
+
+        response = self.client.get(base_url, since)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertFalse(response.data['changed'])
+
+        response = self.client.get(base_url, dict(since, since=document.updated.isoformat()))
+        self.assertTrue(response.data['changed'])
+
+        timer = threading.Timer(0.1, changes.notify, (Document, user.username))
+        timer.start()
+
+        started = time.monotonic()
+        response = self.client.get(base_url, dict(since, timeout=10))
+        self.assertTrue(response.data['changed'])
+        self.assertLess(time.monotonic() - started, 5)
+        timer.join()
+
+        response = self.client.get(base_url, dict(since, timeout='invalid'))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.get(reverse('document-list', kwargs={'user_username': 'missing'}) + 'wait/')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_combined_sync(self):
+        user = User.objects.create(username='test', password='test')
+        Document.objects.create(user=user, title='active', text='test')
+        Document.objects.create(user=user, title='deleted', text='test', deleted=True)
+
+        url = reverse('user-sync', kwargs={'user_username': user.username})
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['since'])
+
+        documents = response.data['documents']
+        self.assertEqual([document['title'] for document in documents['results']], ['active'])
+        self.assertEqual([document['title'] for document in documents['deleted']], ['deleted'])
+        self.assertIsNone(documents['next'])
+        self.assertTrue(documents['partial'])
+
+        response = self.client.get(url, {'since': response.data['until'].isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['documents']['results'], [])
+        self.assertEqual(response.data['documents']['deleted'], [])
+
+        response = self.client.get(reverse('user-sync', kwargs={'user_username': 'missing'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_combined_sync_paginated(self):
+        user = User.objects.create(username='test', password='test')
+        for i in range(2):
+            Document.objects.create(user=user, title='t%d' % i, text='test')
+            Document.objects.create(user=user, title='d%d' % i, text='test', deleted=True)
+
+        with mock.patch.object(SyncCursorPagination, 'page_size', 1):
+            response = self.client.get(reverse('user-sync', kwargs={'user_username': user.username}))
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+            until = response.data['until']
+            documents = response.data['documents']
+            self.assertEqual([document['title'] for document in documents['results']], ['t0'])
+            self.assertEqual([document['title'] for document in documents['deleted']], ['d0'])
+
+            base_url = reverse('document-list', kwargs={'user_username': user.username})
+            self.assertIn(base_url + '?', documents['next'])
+            self.assertIn(base_url + 'deleted/?', documents['deleted_next'])
+
+            response = self.client.get(documents['next'])
+            self.assertEqual([document['title'] for document in response.data['results']], ['t1'])
+            self.assertEqual(response.data['until'], until)
+            self.assertIsNone(response.data['next'])
+
+            response = self.client.get(documents['deleted_next'])
+            self.assertEqual([document['title'] for document in response.data['results']], ['d1'])
+            self.assertIsNone(response.data['next'])
+
+    def test_consistent_reads(self):
+        user = User.objects.create(username='test', password='test')
+        Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        with mock.patch.object(DocumentViewSet, 'consistent_reads', True), \
+                mock.patch('rest_offlinesync.clock.get_write_lag', return_value=datetime.timedelta(seconds=10)):
+            response = self.client.get(base_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(response.data['until'], timezone.now() - datetime.timedelta(seconds=11))
+            self.assertEqual(response.data['results'], [])
+
+        self.assertEqual(clock.get_write_lag(), datetime.timedelta(0))
+
+    def test_tombstone_fields(self):
+        user = User.objects.create(username='test', password='test')
+        documents = [Document.objects.create(user=user, title='test', text='test', deleted=True) for _ in range(2)]
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        with mock.patch.object(DocumentViewSet, 'tombstone_fields', ('id', 'updated')), \
+                mock.patch.object(SyncCursorPagination, 'page_size', 1):
+            response = self.client.get(base_url + 'deleted/')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual(response.data['results'], [{'id': documents[0].id,
+                                                          'updated': documents[0].updated.isoformat()[:-6] + 'Z'}])
+
+            response = self.client.get(response.data['next'])
+            self.assertEqual([tombstone['id'] for tombstone in response.data['results']], [documents[1].id])
+
+            response = self.client.get(base_url)
+            self.assertEqual(response.data['results'], [])
+
+            with mock.patch.object(DocumentViewSet, 'conditional_list', True):
+                response = self.client.get(base_url + 'deleted/')
+                response = self.client.get(base_url + 'deleted/', HTTP_IF_NONE_MATCH=response['ETag'])
+                self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+            with mock.patch.object(DocumentViewSet, 'stream_chunk_size', 1):
+                response = self.client.get(base_url + 'deleted/')
+                data = json.loads(b''.join(response.streaming_content).decode())
+                self.assertEqual([sorted(tombstone) for tombstone in data['results']], [['id', 'updated']] * 2)
+
+        with mock.patch.object(DocumentViewSet, 'tombstone_fields', ('id',)), \
+                mock.patch.object(SyncCursorPagination, 'page_size', 1):
+            response = self.client.get(base_url + 'deleted/')
+            self.assertEqual(response.data['results'], [{'id': documents[0].id}])
+
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.data['results'], [{'id': documents[1].id}])
+
+        with mock.patch.object(DocumentViewSet, 'tombstone_fields', ('id', 'missing')):
+            self.assertRaises(ImproperlyConfigured, self.client.get, base_url + 'deleted/')
+
+    def test_read_replica(self):
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        replica_settings = {'READ_REPLICA': 'default', 'MAX_REPLICA_LAG': 60,
+                            'REPLICA_REPLAY_TIMESTAMP': 'api.tests.get_replay_timestamp'}
+
+        with override_settings(REST_OFFLINESYNC=replica_settings), \
+                mock.patch('api.tests.get_replay_timestamp', return_value=document.updated) as replay_timestamp:
+            response = self.client.get(base_url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['until'], document.updated)
+            self.assertEqual(response.data['results'], [])
+            replay_timestamp.assert_called_once_with('default')
+
+            until = document.updated + datetime.timedelta(microseconds=1)
+            response = self.client.get(base_url, {'until': until.isoformat()})
+            self.assertEqual(len(response.data['results']), 1)
+
+            replay_timestamp.return_value = timezone.now() - datetime.timedelta(seconds=61)
+
+            response = self.client.get(base_url)
+            self.assertGreater(response.data['until'], document.updated)
+            self.assertEqual(len(response.data['results']), 1)
+
+        with override_settings(REST_OFFLINESYNC={'READ_REPLICA': 'missing'}):
+            self.assertRaises(ImproperlyConfigured, get_config)
+
+    def test_batch(self):
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+        data = {'user': user.id, 'title': 'test', 'text': 'test'}
+        at = document.updated.isoformat()
+
+        operations = [
+            {'op': 'create', 'data': data},
+            {'op': 'create', 'data': data},
+            {'op': 'partial_update', 'id': document.id, 'at': '2000-01-01T00:00:00Z', 'data': {'title': 'stale'}},
+            {'op': 'partial_update', 'id': document.id, 'at': at, 'data': {'title': 'fresh'}},
+            {'op': 'destroy', 'id': 0},
+            {'op': 'unknown'},
+        ]
+
+        response = self.client.post(base_url + 'batch/', operations, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data],
+                         [status.HTTP_201_CREATED, status.HTTP_402_PAYMENT_REQUIRED, status.HTTP_409_CONFLICT,
+                          status.HTTP_200_OK, status.HTTP_404_NOT_FOUND, status.HTTP_400_BAD_REQUEST])
+        self.assertEqual(response.data[3]['data']['title'], 'fresh')
+        self.assertEqual(Document.objects.filter(user=user, deleted=False).count(), 2)
+
+        class UndeletableDocumentViewSet(limit.LimitedNestedSyncedModelMixin,
+                                         mixins.CreateModelMixin,
+                                         mixins.UpdateModelMixin,
+                                         viewsets.GenericViewSet):
+            queryset = DocumentViewSet.queryset
+            serializer_class = DocumentViewSet.serializer_class
+            parent_model = DocumentViewSet.parent_model
+            parent_path_model = DocumentViewSet.parent_path_model
+            object_filters = DocumentViewSet.object_filters
+            parent_filters = DocumentViewSet.parent_filters
+            parent_key_filter = DocumentViewSet.parent_key_filter
+
+        view = UndeletableDocumentViewSet.as_view({'post': 'batch'})
+        request = APIRequestFactory().post(base_url + 'batch/', [{'op': 'destroy', 'id': document.id}], format='json')
+
+        response = view(request, user_username=user.username)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([result['status'] for result in response.data], [status.HTTP_405_METHOD_NOT_ALLOWED])
+
+        with mock.patch.object(DocumentViewSet, 'http_method_names', ['get', 'post', 'put', 'patch']):
+            response = self.client.post(base_url + 'batch/', [{'op': 'destroy', 'id': document.id}], format='json')
+            self.assertEqual([result['status'] for result in response.data], [status.HTTP_405_METHOD_NOT_ALLOWED])
+
+        class NoDeletePermission(permissions.BasePermission):
+            def has_permission(self, request, view):
+                return request.method != 'DELETE'
+
+        with mock.patch.object(DocumentViewSet, 'permission_classes', [NoDeletePermission]):
+            response = self.client.delete(base_url + '%d/' % document.id)
+            self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+            response = self.client.post(base_url + 'batch/', [{'op': 'destroy', 'id': document.id}], format='json')
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([result['status'] for result in response.data], [status.HTTP_403_FORBIDDEN])
+
+        self.assertTrue(Document.objects.filter(id=document.id, deleted=False).exists())
+
+    def test_updated_increases(self):
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='test', text='test')
+
+        future = document.updated + datetime.timedelta(seconds=1)
+        document.updated = future
+        document.save()
+        self.assertEqual(document.updated, future + datetime.timedelta(microseconds=1))
+
+        updated = document.updated
+        document.save()
+        self.assertGreater(document.updated, updated)
+
+    def test_config(self):
+        self.assertEqual(get_config().get_limit(User, Document, False), 2)
+
+        with override_settings(REST_OFFLINESYNC={'OBJECT_LIMITS': {'auth.User': {'api.Document': (1, 0)}}}):
+            self.assertEqual(get_config().get_limit(User, Document, False), 1)
+            self.assertIsNone(get_config().get_limit(User, Document, True))
+            self.assertIsNone(get_config().deleted_expiry)
+
+        with override_settings(REST_OFFLINESYNC={'OBJECT_LIMITS': {'auth.User': {'api.Document': 1}}}):
+            self.assertRaises(ImproperlyConfigured, get_config)
+
+        with override_settings(REST_OFFLINESYNC={'OBJECT_LIMITS': {'auth.User': {'api.Missing': (1, 1)}}}):
+            self.assertRaises(ImproperlyConfigured, get_config)
+
+    def test_clear_deleted(self):
+        user = User.objects.create(username='test', password='test')
+        for i in range(5):
+            Document.objects.create(user=user, title='test%d' % i, text='test', deleted=(i < 3))
+        Document.objects.filter(title__in=['test0', 'test1', 'test2', 'test3']) \
+            .update(updated=timezone.now() - datetime.timedelta(days=31))
+
+        out = StringIO()
+        call_command('cleardeleted', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), 'api.Document: 3\nrest_offlinesync.ChangeLogEntry: 0\n')
+        self.assertEqual(Document.objects.count(), 5)
+
+        out = StringIO()
+        call_command('cleardeleted', batch_size=2, stdout=out)
+        self.assertEqual(out.getvalue(), 'api.Document: 3\nrest_offlinesync.ChangeLogEntry: 0\n')
+        self.assertEqual(sorted(Document.objects.values_list('title', flat=True)), ['test3', 'test4'])
+
+    def test_change_log(self):
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+        url = reverse('user-changes', kwargs={'user_username': user.username})
+
+        response = self.client.patch(base_url + '%d/' % document.id, {'title': 'updated'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        for _ in range(3):
+            other = Document.objects.create(user=user, title='other', text='test')
+            response = self.client.delete(base_url + '%d/' % other.id)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['changes'], [])
+
+        with mock.patch.object(feed.ChangeFeedView, 'consistency_margin', datetime.timedelta(seconds=-1)), \
+                mock.patch.object(feed.ChangeFeedView, 'page_size', 6):
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual([(change['id'], change['op']) for change in response.data['changes']],
+                             [(document.id, 'create'), (document.id, 'update'),
+                              (document.id + 1, 'create'), (document.id + 1, 'delete'),
+                              (document.id + 2, 'create'), (document.id + 2, 'delete')])
+            self.assertTrue(response.data['more'])
+
+            response = self.client.get(url, {'after': response.data['last']})
+            self.assertEqual([(change['id'], change['op']) for change in response.data['changes']],
+                             [(document.id + 3, 'create'), (document.id + 3, 'delete'), (document.id + 1, 'evict')])
+            self.assertFalse(response.data['more'])
+
+            ChangeLogEntry.objects.filter(id__lte=response.data['last']).update(
+                created=timezone.now() - datetime.timedelta(days=31))
+            call_command('cleardeleted', stdout=StringIO())
+            self.assertEqual(ChangeLogEntry.objects.count(), 0)
+
+            response = self.client.get(url, {'after': response.data['last']})
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+    def test_compaction(self):
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='active', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        response = self.client.delete(base_url + '%d/' % document.id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(Document.objects.get(id=document.id).text, '')
+
+        for i in range(3):
+            Document.objects.create(user=user, title='test%d' % i, text='test', deleted=(i < 2))
+
+        out = StringIO()
+        call_command('compactdeleted', dry_run=True, stdout=out)
+        self.assertEqual(out.getvalue(), 'api.Document: 2\n')
+
+        out = StringIO()
+        call_command('compactdeleted', batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue(), 'api.Document: 2\n')
+        self.assertEqual(sorted(Document.objects.values_list('title', 'text')),
+                         [('active', ''), ('test0', ''), ('test1', ''), ('test2', 'test')])
+
+        out = StringIO()
+        call_command('compactdeleted', stdout=out)
+        self.assertEqual(out.getvalue(), 'api.Document: 0\n')
+
+        with mock.patch.object(Document, 'compacted_fields', ('user', 'missing')):
+            self.assertEqual([error.id for error in check_sync_indexes(None)],
+                             ['rest_offlinesync.E002', 'rest_offlinesync.E002'])
+
+    def test_tombstone_storage(self):
+        user = User.objects.create(username='test', password='test')
+        documents = [Document.objects.create(user=user, title='test%d' % i, text='test') for i in range(3)]
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        with mock.patch.object(Document, 'tombstone_storage', True):
+            for document in documents:
+                response = self.client.delete(base_url + '%d/' % document.id)
+                self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+            self.assertEqual(Document.objects.count(), 0)
+            self.assertEqual(sorted(Tombstone.objects.values_list('object_id', flat=True)),
+                             [str(document.id) for document in documents[1:]])
+
+            response = self.client.get(base_url + 'deleted/')
+            self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+            self.assertEqual([tombstone['id'] for tombstone in response.data['results']],
+                             [document.id for document in documents[1:]])
+
+            response = self.client.get(base_url + 'deleted/', {'since': response.data['until'].isoformat()})
+            self.assertEqual(response.data['results'], [])
+
+            Tombstone.objects.filter(object_id=str(documents[1].id)) \
+                .update(updated=timezone.now() - datetime.timedelta(days=31))
+
+            out = StringIO()
+            call_command('cleardeleted', stdout=out)
+            self.assertEqual(out.getvalue(), 'api.Document: 0\nrest_offlinesync.Tombstone: 1\nrest_offlinesync.ChangeLogEntry: 0\n')
+            self.assertEqual(Tombstone.objects.count(), 1)
+
+            other = User.objects.create(username='other', password='test')
+            document = Document.objects.create(user=other, title='other', text='test')
+            other_url = reverse('document-list', kwargs={'user_username': other.username})
+
+            response = self.client.delete(other_url + '%d/' % document.id)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+            response = self.client.get(other_url + 'deleted/')
+            self.assertEqual([tombstone['id'] for tombstone in response.data['results']], [document.id])
+
+            response = self.client.get(base_url + 'deleted/')
+            self.assertEqual([tombstone['id'] for tombstone in response.data['results']], [documents[2].id])
+
+            with mock.patch.object(Document, 'change_scope', None):
+                self.assertEqual([error.id for error in check_sync_indexes(None)], ['rest_offlinesync.E001'])
+                self.assertRaises(ImproperlyConfigured, self.client.get, base_url + 'deleted/')
+
+            with mock.patch.object(DocumentViewSet, 'object_filters', {}):
+                self.assertRaises(ImproperlyConfigured, self.client.get, base_url + 'deleted/')
+
+            with mock.patch.object(Document._meta, 'related_objects', (User._meta.get_field('document'),)):
+                self.assertEqual([error.id for error in check_sync_indexes(None)], ['rest_offlinesync.E003'])
+
+        # objects deleted before tombstone storage was enabled
+        legacy = Document.objects.create(user=user, title='legacy', text='test', deleted=True)
+
+        with mock.patch.object(Document, 'tombstone_storage', True):
+            response = self.client.get(base_url)
+            self.assertEqual(response.data['results'], [])
+
+            response = self.client.get(base_url + '%d/' % legacy.id)
+            self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+            out = StringIO()
+            call_command('burydeleted', stdout=out)
+            self.assertEqual(out.getvalue(), 'api.Document: 1\n')
+            self.assertFalse(Document.objects.filter(id=legacy.id).exists())
+
+            response = self.client.get(base_url + 'deleted/')
+            self.assertEqual([tombstone['id'] for tombstone in response.data['results']],
+                             [documents[2].id, legacy.id])
+
+    def test_benchmarks(self):
+        results = benchmarks.run(20, 2)
+        self.assertEqual(len(results), 7)
+        self.assertTrue(all(result.p50 > 0 and result.queries > 0 for result in results))
+        self.assertEqual([result.name for result in results[-3:]], ['destroy', 'deleted (since 10%)', 'cleardeleted'])
+        self.assertTrue(EvictionWatermark.objects.exists())
+
+    def test_benchmark_seed(self):
+        with self.assertNumQueries(4):
+            user = benchmarks.seed(100)
+
+        timestamps = list(Document.objects.filter(user=user).order_by('pk').values_list('updated', flat=True))
+        self.assertEqual(len(timestamps), 100)
+        self.assertEqual(timestamps, sorted(timestamps))
+        self.assertLess(timestamps[0], timezone.now() - datetime.timedelta(days=2 * benchmarks.EXPIRY_DAYS - 1))
+        self.assertLess(timestamps[-1], timezone.now())
+
+    @mock.patch.object(DocumentViewSet, 'collector_class', instrument.Collector)
+    @mock.patch.object(DocumentViewSet, 'server_timing', True)
+    def test_instrumentation(self):
+        user = User.objects.create(username='test', password='test')
+        Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        collected = []
+
+        def receiver(sender, timings, **kwargs):
+            collected.append(timings)
+
+        instrument.timings_collected.connect(receiver, sender=DocumentViewSet)
+        try:
+            response = self.client.get(base_url)
+        finally:
+            instrument.timings_collected.disconnect(receiver, sender=DocumentViewSet)
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertRegex(response['Server-Timing'], r'^parent;dur=[0-9.]+;desc="1 queries", list;dur=[0-9.]+;desc="1 queries"$')
+        self.assertEqual([(phase, timing.queries) for phase, timing in collected[0].items()], [('parent', 1), ('list', 1)])
+
+    @mock.patch.object(DocumentViewSet, 'deferred_parent_check', True)
+    def test_deferred_parent_check(self):
+        user = User.objects.create(username='test', password='test')
+        documents = [Document.objects.create(user=user, title='test%d' % i, text='test', deleted=(i > 0))
+                     for i in range(3)]
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        with self.assertNumQueries(1):
+            response = self.client.get(base_url)
+        self.assertEqual(len(response.data['results']), 1)
+
+        window = {'since': documents[0].updated.isoformat(), 'until': documents[0].updated.isoformat()}
+
+        with self.assertNumQueries(1):
+            response = self.client.get(base_url, window)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['results'], [])
+
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('document-list', kwargs={'user_username': 'missing'}))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+        with mock.patch.object(DocumentViewSet, 'tombstone_fields', ('id',)), \
+                mock.patch.object(SyncCursorPagination, 'page_size', 1):
+            with self.assertNumQueries(1):
+                response = self.client.get(base_url + 'deleted/')
+            self.assertEqual(response.data['results'], [{'id': documents[1].id}])
+
+            response = self.client.get(response.data['next'])
+            self.assertEqual(response.data['results'], [{'id': documents[2].id}])
+
+            # the second query checks the eviction watermark
+            with self.assertNumQueries(2):
+                response = self.client.get(base_url + 'deleted/', window)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['results'], [])
+
+    def test_write_locked(self):
+        User.objects.create(username='test', password='test')
+
+        queryset = write_locked(User.objects.all()).filter(username='test')
+        self.assertEqual(len(queryset), 1)
+        self.assertTrue(queryset.query.select_for_update)
+
+    def test_eviction(self):
+        user = User.objects.create(username='test', password='test')
+        for i in range(3):
+            Document.objects.create(user=user, title='deleted%d' % i, text='test', deleted=True)
+        document = Document.objects.create(user=user, title='active', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+
+        with mock.patch.object(DocumentViewSet, 'eviction_slack', 2):
+            response = self.client.delete(base_url + '%d/' % document.id)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+            self.assertEqual(Document.objects.filter(deleted=True).count(), 4)
+
+        document = Document.objects.create(user=user, title='active', text='test')
+
+        response = self.client.delete(base_url + '%d/' % document.id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(list(Document.objects.filter(deleted=True).order_by('id').values_list('title', flat=True)),
+                         ['active', 'active'])
+
+        watermark = EvictionWatermark.objects.get(parent_key=user.username)
+        first = Document.objects.filter(deleted=True).order_by('updated').first()
+        self.assertLess(watermark.evicted, first.updated)
+
+        response = self.client.get(base_url + 'deleted/')
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+        response = self.client.get(base_url + 'deleted/', {'since': watermark.evicted.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_206_PARTIAL_CONTENT)
+
+        response = self.client.get(base_url + 'deleted/', {'since': first.updated.isoformat()})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class TestTransactionalDocuments(APITransactionTestCase):
+
+    @override_settings(REST_OFFLINESYNC={'LIMIT_COUNTERS': True, 'OBJECT_LIMITS': {'auth.User': {'api.Document': (2, 2)}}})
+    def test_limit_counters(self):
+        user = User.objects.create(username='test', password='test')
+        Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+        data = {'user': user.id, 'title': 'test', 'text': 'test'}
+
+        response = self.client.post(base_url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(ChildCounter.objects.get(parent_key=user.username).active, 2)
+
+        response = self.client.post(base_url, data)
+        self.assertEqual(response.status_code, status.HTTP_402_PAYMENT_REQUIRED)
+
+        response = self.client.delete(base_url + '%d/' % Document.objects.first().id)
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(ChildCounter.objects.get(parent_key=user.username).active, 1)
+
+        # once the counter exists, enforcing the limit does not count the children
+        with self.assertNumQueries(7), CaptureQueriesContext(connection) as queries:
+            response = self.client.post(base_url, data)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(any('COUNT(' in query['sql'] for query in queries.captured_queries))
+
+        ChildCounter.objects.update(active=0)
+
+        out = StringIO()
+        call_command('rebuildcounters', verify=True, stdout=out)
+        self.assertEqual(out.getvalue(), 'auth.User/api.Document: 1 stale\n')
+
+        call_command('rebuildcounters', stdout=out)
+        self.assertEqual(ChildCounter.objects.get(parent_key=user.username).active, 2)
+
+    @override_settings(REST_OFFLINESYNC={'CHANGE_CACHE': 'default'})
+    def test_change_cache(self):
+        cache.clear()
+
+        user = User.objects.create(username='test', password='test')
+        document = Document.objects.create(user=user, title='test', text='test')
+
+        base_url = reverse('document-list', kwargs={'user_username': user.username})
+        since = {'since': document.updated.isoformat()}
+
+        with mock.patch.multiple(DocumentViewSet, deferred_parent_check=True, parent_cache_timeout=60):
+            response = self.client.get(base_url, since)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), 1)
+
+            since = {'since': response.data['until'].isoformat()}
+
+            response = self.client.get(base_url, since)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['results'], [])
+
+            with self.assertNumQueries(0):
+                response = self.client.get(base_url, since)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(response.data['results'], [])
+
+            document.save()
+
+            response = self.client.get(base_url, since)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertEqual(len(response.data['results']), 1)
+
+            response = self.client.delete(base_url + '%d/' % document.id)
+            self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+            response = self.client.get(base_url + 'deleted/', since)
+            self.assertEqual(len(response.data['results']), 1)
+
+    def test_clear_deleted_concurrently(self):
+        user = User.objects.create(username='test', password='test')
+        for i in range(3):
+            Document.objects.create(user=user, title='test%d' % i, text='test', deleted=(i < 2))
+        Document.objects.update(updated=timezone.now() - datetime.timedelta(days=31))
+
+        out = StringIO()
+        call_command('cleardeleted', workers=2, batch_size=1, stdout=out)
+        self.assertEqual(out.getvalue(), 'api.Document: 2\nrest_offlinesync.ChangeLogEntry: 0\n')
+        self.assertEqual(Document.objects.count(), 1)
+
+    def test_write_locked_without_transaction(self):
+        User.objects.create(username='test', password='test')
+
+        queryset = write_locked(User.objects.all()).filter(username='test')
+        self.assertEqual(len(queryset), 1)
+        self.assertFalse(queryset.query.select_for_update)
+
+    def test_parent_locked_on_write(self):
+        user = User.objects.create(username='test', password='test')
+
+        class LockedDocumentSerializer(DocumentSerializer):
+            user = serializers.PrimaryKeyRelatedField(queryset=write_locked(User.objects.all()))
+
+        class AggregateDocumentViewSet(nest.NestedModelMixin,
+                                       mixins.CreateModelMixin,
+                                       viewsets.GenericViewSet):
+            queryset = Document.objects.all()
+            serializer_class = LockedDocumentSerializer
+            parent_model = User
+            safe_parent_path = True
+
+        locked = []
+        fetch_all = WriteLockedQuerySet._fetch_all
+
+        def record_lock(queryset):
+            fetch_all(queryset)
+            locked.append(queryset.query.select_for_update)
+
+        view = AggregateDocumentViewSet.as_view({'post': 'create'})
+        data = {'user': user.id, 'title': 'test', 'text': 'test'}
+
+        queries = {}
+        for parent_locked_on_write in (False, True):
+            request = APIRequestFactory().post('/documents/', data)
+
+            with mock.patch.object(AggregateDocumentViewSet, 'parent_locked_on_write', parent_locked_on_write), \
+                    mock.patch.object(WriteLockedQuerySet, '_fetch_all', record_lock), \
+                    CaptureQueriesContext(connection) as context:
+                response = view(request)
+
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            queries[parent_locked_on_write] = len(context.captured_queries)
+
+        # without the option, the serializer reads the parent outside of a transaction, and the viewset locks it again
+        self.assertEqual(locked, [False, True])
+        self.assertEqual(queries[True], queries[False] - 1)
@@ -14,4 +14,6 @@ user_router.register(r'documents', views.DocumentViewSet)
 urlpatterns = [
     url(r'^', include(root_router.urls)),
     url(r'^', include(user_router.urls)),
+    url(r'^users/(?P<user_username>[^/]+)/sync/$', views.UserSyncView.as_view(), name='user-sync'),
+    url(r'^users/(?P<user_username>[^/]+)/changes/$', views.UserChangeFeedView.as_view(), name='user-changes'),
 ]
@@ -1,6 +1,6 @@
 from django.contrib.auth.models import User
 from rest_framework import viewsets
-from rest_offlinesync import limit
+from rest_offlinesync import combine, feed, limit, paginate
 
 from .models import Document
 from .serializers import UserSerializer, DocumentSerializer
@@ -17,6 +17,7 @@ class DocumentViewSet(limit.LimitedNestedSyncedModelMixin,
                       viewsets.ModelViewSet):
     queryset = Document.objects.all()
     serializer_class = DocumentSerializer
+    pagination_class = paginate.SyncCursorPagination
 
     parent_model = User
     parent_path_model = User
@@ -24,3 +25,12 @@ class DocumentViewSet(limit.LimitedNestedSyncedModelMixin,
     object_filters = {'user_id': 'user_username'}
     parent_filters = {'username': 'user_username'}
     parent_key_filter = 'user_id'
+
+
+class UserSyncView(combine.CombinedSyncView):
+    viewsets = (('documents', DocumentViewSet),)
+
+
+class UserChangeFeedView(feed.ChangeFeedView):
+    models = (Document,)
+    scope_kwarg = 'user_username'
@@ -0,0 +1 @@
+default_app_config = 'rest_offlinesync.apps.OfflineSyncConfig'
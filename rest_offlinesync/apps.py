@@ -0,0 +1,13 @@
+from django.apps import AppConfig
+
+
+class OfflineSyncConfig(AppConfig):
+    name = 'rest_offlinesync'
+    verbose_name = 'REST Offline Sync'
+
+    def ready(self):
+        from . import checks, changes, notifiers
+        from .conf import get_config
+
+        # validate the settings at startup, instead of during the first request
+        get_config()
@@ -0,0 +1,81 @@
+import hashlib
+import random
+
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import Signal, receiver
+
+from .conf import get_config
+from .models import TrackedModel
+
+
+scope_changed = Signal(providing_args=['scope'])
+
+
+def _get_cache_keys(model, scope):
+    digest = hashlib.md5(str(scope).encode()).hexdigest()
+
+    key = 'rest_offlinesync:changes:%s:%s' % (model._meta.label, digest)
+
+    return key + ':generation', key + ':version'
+
+
+def _new_generation():
+    return random.getrandbits(63)
+
+
+def notify(model, scope):
+    alias = get_config().change_cache
+
+    if alias is not None:
+        generation_key, _ = _get_cache_keys(model, scope)
+        cache = caches[alias]
+
+        # versions are invalidated by incrementing the generation, which is atomic, unlike updating the version
+        try:
+            cache.incr(generation_key)
+        except ValueError:
+            cache.set(generation_key, _new_generation(), None)
+
+    scope_changed.send(sender=model, scope=scope)
+
+
+def changed(model, scope, using=None):
+    transaction.on_commit(lambda: notify(model, scope), using=using)
+
+
+def is_unchanged(model, scope, since, get_version):
+    alias = get_config().change_cache
+    if alias is None:
+        return False
+
+    generation_key, version_key = _get_cache_keys(model, scope)
+    cache = caches[alias]
+
+    values = cache.get_many([generation_key, version_key])
+
+    generation = values.get(generation_key)
+    if generation is None:
+        cache.add(generation_key, _new_generation(), None)
+        generation = cache.get(generation_key)
+
+    cached = values.get(version_key)
+
+    if cached is not None and cached[0] == generation:
+        version = cached[1]
+
+    else:
+        # the generation is read before the version, so a concurrent change leaves the cached version invalid
+        version = get_version()
+        cache.set(version_key, (generation, version))
+
+    return version is None or since > version
+
+
+@receiver(post_save)
+def track_change(sender, instance, raw=False, using=None, **kwargs):
+    if raw or not issubclass(sender, TrackedModel) or sender.change_scope is None:
+        return
+
+    changed(sender, getattr(instance, sender.change_scope), using)
@@ -0,0 +1,95 @@
+from django.apps import apps
+from django.core import checks
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+
+from .models import SYNC_INDEX_FIELDS, TrackedModel
+
+
+def _get_index_prefixes(model):
+    opts = model._meta
+
+    fields = [index.fields for index in opts.indexes] + list(opts.index_together)
+
+    # descending fields serve the same range scans as ascending ones
+    return [[opts.get_field(name.lstrip('-')).name for name in index_fields] for index_fields in fields]
+
+
+def _has_index(prefixes, fields):
+    return any(prefix[:len(fields)] == fields for prefix in prefixes)
+
+
+@checks.register(checks.Tags.models)
+def check_sync_indexes(app_configs, **kwargs):
+    errors = []
+
+    if app_configs is None:
+        models_list = apps.get_models()
+    else:
+        models_list = [model for app_config in app_configs for model in app_config.get_models()]
+
+    for model in models_list:
+        if not issubclass(model, TrackedModel) or model._meta.proxy:
+            continue
+
+        if model.tombstone_storage and not model.change_scope:
+            errors.append(checks.Error(
+                "%s uses tombstone storage without a change scope." % model._meta.label,
+                hint="Set change_scope to the field that references the parent of the model.",
+                obj=model,
+                id='rest_offlinesync.E001',
+            ))
+
+        if model.tombstone_storage:
+            for rel in model._meta.related_objects:
+                if rel.on_delete is models.CASCADE:
+                    errors.append(checks.Error(
+                        "%s uses tombstone storage, but deleting it cascades to %s." %
+                        (model._meta.label, rel.related_model._meta.label),
+                        hint="Children removed by the cascade get no tombstones; "
+                             "use another on_delete option for %s." % rel.field.name,
+                        obj=model,
+                        id='rest_offlinesync.E003',
+                    ))
+
+        for name in model.compacted_fields:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                field = None
+
+            if field is None or (field.get_default() is None and not field.null):
+                errors.append(checks.Error(
+                    "%s cannot compact the field %r." % (model._meta.label, name),
+                    hint="Compacted fields must have a default, allow null values, or allow empty strings.",
+                    obj=model,
+                    id='rest_offlinesync.E002',
+                ))
+
+        prefixes = _get_index_prefixes(model)
+        sync_fields = SYNC_INDEX_FIELDS[:2]
+
+        if not _has_index(prefixes, sync_fields):
+            errors.append(checks.Warning(
+                "%s has no index on (%s)." % (model._meta.label, ', '.join(sync_fields)),
+                hint="Add rest_offlinesync.models.sync_indexes() to the model's Meta.indexes.",
+                obj=model,
+                id='rest_offlinesync.W001',
+            ))
+
+        for field in model._meta.get_fields():
+            if not isinstance(field, models.ForeignKey):
+                continue
+
+            if not _has_index(prefixes, [field.name] + sync_fields):
+                errors.append(checks.Warning(
+                    "%s has no index on (%s) for synchronization of nested objects." %
+                    (model._meta.label, ', '.join([field.name] + sync_fields)),
+                    hint="Add rest_offlinesync.models.sync_indexes('%s') to the model's Meta.indexes, "
+                         "or silence this check if %s is not a parent of nested viewsets." %
+                         (field.name, field.name),
+                    obj=model,
+                    id='rest_offlinesync.W002',
+                ))
+
+    return errors
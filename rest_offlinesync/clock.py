@@ -0,0 +1,55 @@
+import datetime
+import threading
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.utils import timezone
+
+
+class MonotonicClock(object):
+    resolution = datetime.timedelta(microseconds=1)
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.last = None
+
+    def now(self, after=None):
+        with self.lock:
+            timestamp = timezone.now()
+
+            # like a hybrid logical clock, advance past the last issued timestamp
+            # and the previous one of the object, instead of waiting for the wall clock
+            for floor in (self.last, after):
+                if floor is not None and timestamp <= floor:
+                    timestamp = floor + self.resolution
+
+            self.last = timestamp
+
+        return timestamp
+
+
+WRITE_LAG_QUERIES = {
+    'postgresql': "SELECT EXTRACT(EPOCH FROM clock_timestamp() - MIN(xact_start)) FROM pg_stat_activity "
+                  "WHERE backend_xid IS NOT NULL AND pid <> pg_backend_pid()",
+    'mysql': "SELECT TIMESTAMPDIFF(MICROSECOND, MIN(trx_started), NOW(6)) / 1000000 FROM information_schema.innodb_trx "
+             "WHERE trx_mysql_thread_id <> CONNECTION_ID()",
+}
+
+
+def get_write_lag(using=DEFAULT_DB_ALIAS):
+    connection = connections[using]
+
+    query = WRITE_LAG_QUERIES.get(connection.vendor)
+    if query is None:
+        return datetime.timedelta(0)
+
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        seconds, = cursor.fetchone()
+
+    return datetime.timedelta(seconds=max(float(seconds or 0), 0))
+
+
+def safe_now(margin, using=DEFAULT_DB_ALIAS):
+    # objects modified by write transactions in progress are timestamped after these transactions started,
+    # so all objects modified before the returned time have been committed
+    return timezone.now() - get_write_lag(using) - margin
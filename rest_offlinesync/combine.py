@@ -0,0 +1,101 @@
+import copy
+import datetime
+from collections import OrderedDict
+
+from django.core.exceptions import ImproperlyConfigured
+from django.db import connection, transaction
+from django.http import QueryDict
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import views
+from rest_framework.response import Response
+
+from . import clock
+from .sync import SyncedModelMixin, DEFAULT_SINCE_PARAM, DEFAULT_UNTIL_PARAM
+
+
+class CombinedSyncView(views.APIView):
+    viewsets = ()
+
+    since_param = DEFAULT_SINCE_PARAM
+    until_param = DEFAULT_UNTIL_PARAM
+
+    consistent_reads = False
+    consistency_margin = datetime.timedelta(seconds=1)
+
+    def get_default_until(self):
+        if self.consistent_reads:
+            return clock.safe_now(self.consistency_margin)
+
+        return timezone.now()
+
+    def get_viewset_url(self, viewset, action, *args, **kwargs):
+        basename = viewset.queryset.model._meta.model_name
+
+        return reverse('%s-%s' % (basename, action), args=args, kwargs=kwargs)
+
+    def _get_view_request(self, request, viewset, action, since, until, *args, **kwargs):
+        view_request = copy.copy(request._request)
+
+        view_request.GET = QueryDict(mutable=True)
+        if since is not None:
+            view_request.GET[viewset.since_param] = since.isoformat()
+        view_request.GET[viewset.until_param] = until.isoformat()
+
+        view_request.META = {key: value for key, value in view_request.META.items() if key != 'HTTP_IF_NONE_MATCH'}
+
+        # the links to the next pages lead to the viewset's own endpoints
+        view_request.path = view_request.path_info = self.get_viewset_url(viewset, action, *args, **kwargs)
+        view_request.META['PATH_INFO'] = view_request.path_info
+        view_request.META['QUERY_STRING'] = view_request.GET.urlencode()
+
+        # the user is only authenticated once
+        view_request._force_auth_user = request.user
+        view_request._force_auth_token = request.auth
+
+        return view_request
+
+    def _call_viewset(self, request, viewset, action, since, until, *args, **kwargs):
+        view = viewset.as_view({'get': action})
+
+        response = view(self._get_view_request(request, viewset, action, since, until, *args, **kwargs),
+                        *args, **kwargs)
+
+        if not hasattr(response, 'data'):
+            raise ImproperlyConfigured('%s: combined synchronization of streamed lists is not supported' %
+                                       viewset.__name__)
+
+        return response
+
+    def get(self, request, *args, **kwargs):
+        since = SyncedModelMixin.get_timestamp(request, self.since_param)
+
+        in_transaction = connection.in_atomic_block
+
+        with transaction.atomic():
+            # all lists are read from the same snapshot, unless the request is already in a transaction
+            if connection.vendor == 'postgresql' and not in_transaction:
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+
+            until = SyncedModelMixin.get_timestamp(request, self.until_param, self.get_default_until())
+
+            data = OrderedDict(((self.since_param, since),
+                                (self.until_param, until)))
+
+            for name, viewset in self.viewsets:
+                list_response = self._call_viewset(request, viewset, 'list', since, until, *args, **kwargs)
+                if list_response.exception:
+                    return list_response
+
+                deleted_response = self._call_viewset(request, viewset, 'deleted', since, until, *args, **kwargs)
+                if deleted_response.exception:
+                    return deleted_response
+
+                data[name] = OrderedDict((('results', list_response.data['results']),
+                                          ('next', list_response.data.get('next')),
+                                          ('deleted', deleted_response.data['results']),
+                                          ('deleted_next', deleted_response.data.get('next')),
+                                          ('partial', deleted_response.status_code == 206)))
+
+        return Response(data)
@@ -0,0 +1,167 @@
+import datetime
+from collections import namedtuple
+
+from django.apps import apps
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils.module_loading import import_string
+
+
+SETTINGS_NAME = 'REST_OFFLINESYNC'
+
+DEFAULT_CLOCK = 'rest_offlinesync.clock.MonotonicClock'
+DEFAULT_NOTIFIER = 'rest_offlinesync.notifiers.LocalNotifier'
+DEFAULT_REPLAY_TIMESTAMP = 'rest_offlinesync.replica.get_replay_timestamp'
+
+
+class Config(namedtuple('Config', ('deleted_expiry', 'object_limits', 'limit_counters', 'clock',
+                                     'change_cache', 'notifier', 'read_replica', 'max_replica_lag',
+                                     'replay_timestamp'))):
+    __slots__ = ()
+
+    def get_limit(self, parent_model, child_model, deleted):
+        limits = self.object_limits.get((parent_model, child_model))
+        if not limits:
+            return None
+
+        return limits[int(deleted)]
+
+
+def _get_model(label):
+    try:
+        return apps.get_model(label)
+    except (LookupError, ValueError):
+        raise ImproperlyConfigured('%s: unknown model %r in OBJECT_LIMITS' % (SETTINGS_NAME, label))
+
+
+def _compile_limits(limits):
+    if not limits:
+        return {}
+
+    if not isinstance(limits, dict):
+        raise ImproperlyConfigured('%s: OBJECT_LIMITS must be a dict' % SETTINGS_NAME)
+
+    object_limits = {}
+
+    for parent_label, parent_limits in limits.items():
+        parent_model = _get_model(parent_label)
+
+        if not isinstance(parent_limits, dict):
+            raise ImproperlyConfigured('%s: limits of %s must be a dict' % (SETTINGS_NAME, parent_label))
+
+        for child_label, child_limit in parent_limits.items():
+            child_model = _get_model(child_label)
+
+            if not child_limit:
+                continue
+
+            if not isinstance(child_limit, (tuple, list)) or len(child_limit) != 2 or \
+                    not all(limit is None or (isinstance(limit, int) and limit >= 0) for limit in child_limit):
+                raise ImproperlyConfigured('%s: limits of %s per %s must be a pair of non-negative integers' %
+                                           (SETTINGS_NAME, child_label, parent_label))
+
+            object_limits[(parent_model, child_model)] = tuple(limit or None for limit in child_limit)
+
+    return object_limits
+
+
+def _compile_expiry(expiry_days):
+    if not expiry_days:
+        return None
+
+    if not isinstance(expiry_days, (int, float)) or expiry_days < 0:
+        raise ImproperlyConfigured('%s: DELETED_EXPIRY_DAYS must be a non-negative number' % SETTINGS_NAME)
+
+    return datetime.timedelta(days=expiry_days)
+
+
+def _compile_clock(path):
+    try:
+        return import_string(path or DEFAULT_CLOCK)()
+    except ImportError as e:
+        raise ImproperlyConfigured('%s: invalid TIMESTAMP_CLOCK: %s' % (SETTINGS_NAME, e))
+
+
+def _compile_notifier(path):
+    try:
+        return import_string(path or DEFAULT_NOTIFIER)()
+    except ImportError as e:
+        raise ImproperlyConfigured('%s: invalid CHANGE_NOTIFIER: %s' % (SETTINGS_NAME, e))
+
+
+def _compile_cache(alias):
+    if alias is None:
+        return None
+
+    if alias not in settings.CACHES:
+        raise ImproperlyConfigured('%s: unknown cache %r in CHANGE_CACHE' % (SETTINGS_NAME, alias))
+
+    return alias
+
+
+def _compile_replica(alias):
+    if alias is None:
+        return None
+
+    if alias not in settings.DATABASES:
+        raise ImproperlyConfigured('%s: unknown database %r in READ_REPLICA' % (SETTINGS_NAME, alias))
+
+    return alias
+
+
+def _compile_lag(lag_seconds):
+    if lag_seconds is None:
+        return None
+
+    if not isinstance(lag_seconds, (int, float)) or lag_seconds < 0:
+        raise ImproperlyConfigured('%s: MAX_REPLICA_LAG must be a non-negative number' % SETTINGS_NAME)
+
+    return datetime.timedelta(seconds=lag_seconds)
+
+
+def _compile_replay_timestamp(path):
+    try:
+        return import_string(path or DEFAULT_REPLAY_TIMESTAMP)
+    except ImportError as e:
+        raise ImproperlyConfigured('%s: invalid REPLICA_REPLAY_TIMESTAMP: %s' % (SETTINGS_NAME, e))
+
+
+def build_config():
+    user_settings = getattr(settings, SETTINGS_NAME, None) or {}
+
+    if not isinstance(user_settings, dict):
+        raise ImproperlyConfigured('%s must be a dict' % SETTINGS_NAME)
+
+    return Config(deleted_expiry=_compile_expiry(user_settings.get('DELETED_EXPIRY_DAYS')),
+                  object_limits=_compile_limits(user_settings.get('OBJECT_LIMITS')),
+                  limit_counters=bool(user_settings.get('LIMIT_COUNTERS')),
+                  clock=_compile_clock(user_settings.get('TIMESTAMP_CLOCK')),
+                  change_cache=_compile_cache(user_settings.get('CHANGE_CACHE')),
+                  notifier=_compile_notifier(user_settings.get('CHANGE_NOTIFIER')),
+                  read_replica=_compile_replica(user_settings.get('READ_REPLICA')),
+                  max_replica_lag=_compile_lag(user_settings.get('MAX_REPLICA_LAG')),
+                  replay_timestamp=_compile_replay_timestamp(user_settings.get('REPLICA_REPLAY_TIMESTAMP')))
+
+
+_config = None
+
+
+def get_config():
+    global _config
+
+    config = _config
+
+    if config is None:
+        config = _config = build_config()
+
+    return config
+
+
+@receiver(setting_changed)
+def reset_config(setting, **kwargs):
+    global _config
+
+    if setting == SETTINGS_NAME:
+        _config = None
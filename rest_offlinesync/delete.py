@@ -1,23 +1,102 @@
-from rest_framework import decorators
+from collections import OrderedDict
 
+from django.core.exceptions import FieldDoesNotExist, ImproperlyConfigured
+from django.db import models
+from rest_framework import decorators, serializers
+
+from . import changes
 from .mixin import ViewSetMixin
+from .models import TrackedModel, Tombstone
+
+
+class TombstoneIdField(serializers.ReadOnlyField):
+
+    def __init__(self, model, **kwargs):
+        super().__init__(source='object_id', **kwargs)
+
+        self.model = model
+
+    def to_representation(self, value):
+        return self.model._meta.pk.to_python(value)
 
 
 class DeletableModelMixin(ViewSetMixin):
+    tombstone_fields = None
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.deleted_object = False
 
+    def uses_tombstones(self):
+        model = self.queryset.model
+        return issubclass(model, TrackedModel) and model.tombstone_storage
+
+    def get_tombstone_queryset(self):
+        model = self.queryset.model
+
+        # tombstones are only filtered by their scope, so they must not be listed without one
+        scope = self.get_change_scope()
+        if scope is None:
+            raise ImproperlyConfigured('%s: tombstone storage of %s requires a change scope, '
+                                       'which is a key of object_filters' %
+                                       (type(self).__name__, model._meta.label))
+
+        return Tombstone.objects.filter(model=model._meta.label, scope=str(scope))
+
+    def get_tombstone_values(self):
+        model = self.queryset.model
+
+        for name in self.tombstone_fields:
+            try:
+                model._meta.get_field(name)
+            except FieldDoesNotExist:
+                raise ImproperlyConfigured('%s: tombstone field %r is not a field of %s' %
+                                           (type(self).__name__, name, model._meta.label))
+
+        # the cursor pagination positions the rows by these fields, even if they are not returned
+        return tuple(self.tombstone_fields) + tuple(name for name in ('updated', 'id')
+                                                    if name not in self.tombstone_fields)
+
     def get_queryset(self):
+        if self.deleted_object and self.uses_tombstones():
+            return self.get_tombstone_queryset().using(self.read_db)
+
+        # objects deleted before tombstone storage was enabled remain in the table until they are buried
         queryset = super().get_queryset()
 
         if self.deleted_object is not None:
             queryset = queryset.filter(deleted=self.deleted_object)
 
+        if self.deleted_object and self.tombstone_fields:
+            queryset = queryset.values(*self.get_tombstone_values())
+
         return queryset
 
+    def get_tombstone_serializer_class(self):
+        model = self.queryset.model
+
+        fields = OrderedDict()
+
+        if self.uses_tombstones():
+            fields['id'] = TombstoneIdField(model)
+            fields['updated'] = serializers.DateTimeField(read_only=True)
+
+        else:
+            for name in self.tombstone_fields:
+                if isinstance(model._meta.get_field(name), models.DateTimeField):
+                    fields[name] = serializers.DateTimeField(read_only=True)
+                else:
+                    fields[name] = serializers.ReadOnlyField()
+
+        return type(model.__name__ + 'TombstoneSerializer', (serializers.Serializer,), fields)
+
+    def get_serializer_class(self):
+        if self.deleted_object and (self.tombstone_fields or self.uses_tombstones()):
+            return self.get_tombstone_serializer_class()
+
+        return super().get_serializer_class()
+
     @decorators.list_route(suffix='Archive')
     def deleted(self, request, *args, **kwargs):
         self.deleted_object = True
@@ -25,4 +104,19 @@ class DeletableModelMixin(ViewSetMixin):
 
     def perform_destroy(self, instance):
         instance.deleted = True
+
+        if self.uses_tombstones():
+            scope = instance.get_change_scope()
+
+            Tombstone.objects.bury(instance, scope)
+
+            # the object is not saved, so the change is tracked here
+            if instance.change_scope:
+                changes.changed(type(instance), scope, instance._state.db)
+
+            return
+
+        if isinstance(instance, TrackedModel):
+            instance.compact()
+
         instance.save()
@@ -0,0 +1,72 @@
+import datetime
+from collections import OrderedDict
+
+from rest_framework import exceptions, status, views
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from . import clock
+from .models import ChangeLogEntry
+
+
+DEFAULT_AFTER_PARAM = 'after'
+
+
+class ChangeFeedView(views.APIView):
+    models = ()
+    scope_kwarg = None
+
+    after_param = DEFAULT_AFTER_PARAM
+    page_size = api_settings.PAGE_SIZE or 100
+
+    consistency_margin = datetime.timedelta(seconds=1)
+
+    def get_scope(self):
+        return self.kwargs[self.scope_kwarg]
+
+    def get_after(self, request):
+        after_repr = request.query_params.get(self.after_param)
+        if after_repr is None:
+            return None
+
+        try:
+            after = int(after_repr)
+        except ValueError:
+            raise exceptions.ValidationError({self.after_param: 'invalid sequence number'})
+
+        return after
+
+    def get(self, request, *args, **kwargs):
+        after = self.get_after(request)
+
+        models = {model._meta.label: model for model in self.models}
+
+        entries = ChangeLogEntry.objects.filter(scope=str(self.get_scope()), model__in=list(models))
+
+        partial = False
+
+        if after is not None:
+            # clients only receive the sequence numbers of existing entries, so missing ones have been trimmed
+            partial = not ChangeLogEntry.objects.filter(id=after).exists()
+
+            entries = entries.filter(id__gt=after)
+
+        # entries of write transactions in progress are created after the watermark, and are left for the next request
+        watermark = clock.safe_now(self.consistency_margin, ChangeLogEntry.objects.db)
+        entries = list(entries.filter(created__lt=watermark).order_by('id')[:self.page_size + 1])
+
+        more = len(entries) > self.page_size
+        entries = entries[:self.page_size]
+
+        changes = [OrderedDict((('seq', entry.id),
+                                ('model', entry.model),
+                                ('id', models[entry.model]._meta.pk.to_python(entry.object_id)),
+                                ('op', entry.op)))
+                   for entry in entries]
+
+        data = OrderedDict(((self.after_param, after),
+                            ('last', entries[-1].id if entries else after),
+                            ('more', more),
+                            ('changes', changes)))
+
+        return Response(data, status=status.HTTP_206_PARTIAL_CONTENT if partial else status.HTTP_200_OK)
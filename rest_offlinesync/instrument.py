@@ -0,0 +1,60 @@
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.db import connections
+from django.dispatch import Signal
+
+
+timings_collected = Signal(providing_args=['view', 'request', 'response', 'timings'])
+
+
+class Timing(object):
+
+    def __init__(self):
+        self.duration = 0.0
+        self.queries = 0
+
+
+@contextmanager
+def unmeasured():
+    yield
+
+
+class Collector(object):
+
+    def __init__(self, view):
+        self.view = view
+        self.timings = OrderedDict()
+
+    @contextmanager
+    def measure(self, phase):
+        # queries are counted through the debug cursor, which is only forced while a phase is measured
+        debug_states = [(connection, connection.force_debug_cursor) for connection in connections.all()]
+        for connection, _ in debug_states:
+            connection.force_debug_cursor = True
+
+        start_queries = sum(len(connection.queries_log) for connection, _ in debug_states)
+        start = time.perf_counter()
+
+        try:
+            yield
+
+        finally:
+            duration = time.perf_counter() - start
+            queries = sum(len(connection.queries_log) for connection, _ in debug_states) - start_queries
+
+            for connection, debug_state in debug_states:
+                connection.force_debug_cursor = debug_state
+
+            timing = self.timings.setdefault(phase, Timing())
+            timing.duration += duration
+            timing.queries += queries
+
+    def get_server_timing(self):
+        return ', '.join('%s;dur=%.3f;desc="%d queries"' % (phase, timing.duration * 1000, timing.queries)
+                         for phase, timing in self.timings.items())
+
+    def report(self, request, response):
+        timings_collected.send(sender=self.view.__class__, view=self.view, request=request, response=response,
+                               timings=self.timings)
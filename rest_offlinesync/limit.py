@@ -1,11 +1,9 @@
-from django.conf import settings
 from django.db import transaction
-from django.db.models import Subquery
-from django.db.models import Count, Min
 from django.shortcuts import get_object_or_404
 from rest_framework import exceptions, status, decorators
 
-from .models import TrackedModel
+from .conf import get_config
+from .models import TrackedModel, ChildCounter, EvictionWatermark, Tombstone, ChangeLogEntry
 from .nest import NestedModelMixin
 from .sync import SyncedModelMixin
 
@@ -18,53 +16,71 @@ class LimitExceededError(exceptions.APIException):
 class LimitedNestedSyncedModelMixin(NestedModelMixin, SyncedModelMixin):
     parent_key_filter = None
 
-    def get_limit(self, deleted):
-        limits = getattr(settings, 'REST_OFFLINESYNC', None) and settings.REST_OFFLINESYNC.get('OBJECT_LIMITS')
-        if not limits:
-            return None
+    eviction_slack = 0
+    max_evictions = 100
 
-        parent_limits = limits.get(self.parent_model._meta.label)
-        if not parent_limits:
-            return None
+    def get_limit(self, deleted):
+        return get_config().get_limit(self.parent_model, self.queryset.model, deleted)
 
-        child_limit = parent_limits.get(self.queryset.model._meta.label)
-        if not child_limit:
-            return None
+    def _get_parent_keys(self):
+        kwarg = self.object_filters.get(self.parent_key_filter)
+        if kwarg is not None:
+            return [self.kwargs[kwarg]]
 
-        limit = child_limit[int(deleted)]
-        if not limit:
-            return None
+        target_field = self._get_parent_field().target_field
 
-        return limit
+        return list(self.get_parent_queryset(False, False).values_list(target_field.attname, flat=True))
 
     def _is_potentially_evicted(self):
-        del_limit = self.get_limit(True)
-        if not del_limit:
+        if not self.get_limit(True):
             return False
 
-        filter_kwargs = {expr: self.kwargs[kwarg] for expr, kwarg in self.object_filters.items()}
-        filter_kwargs['deleted'] = True
+        parent_keys = [str(parent_key) for parent_key in self._get_parent_keys()]
 
-        results = self.queryset.filter(**filter_kwargs)
-        results = results.values(self.parent_key_filter)
-        results = results.annotate(ndel=Count('*'), oldest=Min('updated'))
-        results = results.filter(ndel__gte=del_limit)
+        watermarks = EvictionWatermark.objects.filter(parent_model=self.parent_model._meta.label,
+                                                      child_model=self.queryset.model._meta.label,
+                                                      parent_key__in=parent_keys)
 
+        # objects modified before since had already been deleted when the client last synchronized
         if self.since is not None:
-            results = results.filter(oldest__gte=self.since)
+            watermarks = watermarks.filter(evicted__gte=self.since)
 
-        return len(results) > 0
+        return watermarks.exists()
 
     @decorators.list_route(suffix='Archive')
     def deleted(self, request, *args, **kwargs):
         response = super().deleted(request, *args, **kwargs)
 
         if response.status_code == status.HTTP_200_OK:
-            if self._is_potentially_evicted():
+            with self.measure('eviction_check'):
+                evicted = self._is_potentially_evicted()
+
+            if evicted:
                 response.status_code = status.HTTP_206_PARTIAL_CONTENT
 
         return response
 
+    def _get_parent_field(self):
+        return self.queryset.model._meta.get_field(self.get_parent_name())
+
+    def _count_active(self, parent_key):
+        filter_kwargs = {self._get_parent_field().attname: parent_key}
+
+        if issubclass(self.queryset.model, TrackedModel):
+            filter_kwargs['deleted'] = False
+
+        return self.queryset.filter(**filter_kwargs).count()
+
+    def _adjust_active_count(self, parent_key, delta):
+        if not get_config().limit_counters or not self.get_limit(False):
+            return
+
+        ChildCounter.objects.adjust(self.parent_model, self.queryset.model, parent_key, delta,
+                                    lambda: self._count_active(parent_key))
+
+    def _get_active_state(self, instance):
+        return getattr(instance, self._get_parent_field().attname), not getattr(instance, 'deleted', False)
+
     def _check_active_limits(self, parent):
         limit = self.get_limit(False)
         if not limit:
@@ -72,13 +88,17 @@ class LimitedNestedSyncedModelMixin(NestedModelMixin, SyncedModelMixin):
 
         object_type = self.queryset.model
 
-        child_set_name = object_type._meta.model_name + '_set'
-        child_set = getattr(parent, child_set_name)
+        parent_key = getattr(parent, self._get_parent_field().target_field.attname)
+
+        with self.measure('limit'):
+            if get_config().limit_counters:
+                count = ChildCounter.objects.get_active(self.parent_model, object_type, parent_key,
+                                                        lambda: self._count_active(parent_key))
 
-        if issubclass(object_type, TrackedModel):
-            child_set = child_set.filter(deleted=False)
+            else:
+                count = self._count_active(parent_key)
 
-        if child_set.count() >= limit:
+        if count >= limit:
             raise LimitExceededError('exceeded limit of %d %s per %s' %
                                      (limit, object_type._meta.verbose_name_plural, parent._meta.verbose_name))
 
@@ -87,14 +107,37 @@ class LimitedNestedSyncedModelMixin(NestedModelMixin, SyncedModelMixin):
         if not limit:
             return
 
-        filter_kwargs = {}
-        filter_kwargs[self.parent_key_filter] = getattr(instance, self.parent_key_filter)
-        filter_kwargs['deleted'] = True
+        if self.uses_tombstones():
+            # the change scope of the model is its parent key
+            peers = Tombstone.objects.filter(model=self.queryset.model._meta.label,
+                                             scope=str(getattr(instance, self.parent_key_filter)))
 
-        delete_ids = Subquery(self.queryset.filter(**filter_kwargs).order_by('-updated', '-id')[limit:].values('id'))
+        else:
+            filter_kwargs = {}
+            filter_kwargs[self.parent_key_filter] = getattr(instance, self.parent_key_filter)
+            filter_kwargs['deleted'] = True
+
+            peers = self.queryset.filter(**filter_kwargs)
+
+        peers = peers.order_by('-updated', '-id')
+
+        object_field = 'object_id' if self.uses_tombstones() else 'id'
+
+        with self.measure('evict'):
+            # only the bounded overflow past the limit is read, and it is evicted once it exceeds the slack
+            excess = list(peers.values_list('id', 'updated', object_field)
+                          [limit:limit + self.eviction_slack + self.max_evictions])
+
+            if len(excess) > self.eviction_slack:
+                peers.filter(id__in=[id for id, _, _ in excess]).delete()
 
-        delete_objs = self.queryset.filter(id__in=delete_ids)
-        delete_objs.delete()
+                EvictionWatermark.objects.raise_to(self.parent_model, self.queryset.model,
+                                                   getattr(instance, self.parent_key_filter),
+                                                   max(updated for _, updated, _ in excess))
+
+                if instance.change_log:
+                    ChangeLogEntry.objects.append(self.queryset.model, [object_id for _, _, object_id in excess],
+                                                  instance.get_change_scope(), ChangeLogEntry.EVICT)
 
     @transaction.atomic(savepoint=False)
     def perform_create(self, serializer):
@@ -104,7 +147,7 @@ class LimitedNestedSyncedModelMixin(NestedModelMixin, SyncedModelMixin):
         save_kwargs = {}
 
         if self.is_aggregate():
-            parent = self.locked_parent(serializer.validated_data[parent_name])
+            parent = self.get_validated_parent(serializer)
 
         else:
             parent = self.get_parent(False, True)
@@ -115,16 +158,31 @@ class LimitedNestedSyncedModelMixin(NestedModelMixin, SyncedModelMixin):
 
         serializer.save(**save_kwargs)
 
+        self._adjust_active_count(self._get_active_state(serializer.instance)[0], 1)
+
     @transaction.atomic(savepoint=False)
     def perform_update(self, serializer):
+        old_parent_key, was_active = self._get_active_state(serializer.instance)
+
         if self.is_aggregate():
-            parent = self.locked_parent(serializer.validated_data[self.get_parent_name()])
+            parent = self.get_validated_parent(serializer)
 
             self._check_active_limits(parent)
 
-        return super().perform_update(serializer)
+        super().perform_update(serializer)
+
+        # objects may be moved to another parent, or undeleted
+        new_parent_key, is_active = self._get_active_state(serializer.instance)
+
+        if (old_parent_key, was_active) != (new_parent_key, is_active):
+            if was_active:
+                self._adjust_active_count(old_parent_key, -1)
+            if is_active:
+                self._adjust_active_count(new_parent_key, 1)
 
     def perform_destroy(self, instance):
         super().perform_destroy(instance)
 
+        self._adjust_active_count(self._get_active_state(instance)[0], -1)
+
         self._evict_deleted_peers(instance)
@@ -0,0 +1,68 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import router, transaction
+
+from rest_offlinesync import changes
+from rest_offlinesync.models import TrackedModel, Tombstone
+
+
+class Command(BaseCommand):
+    help = 'Move deleted objects, which were deleted before tombstone storage was enabled, to the tombstones.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='bury objects in batches of this size, in primary key order, each in a transaction')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only count the objects to bury')
+
+    @staticmethod
+    def get_tombstone_models():
+        return [model for model in apps.get_models()
+                if issubclass(model, TrackedModel) and model.tombstone_storage and not model._meta.proxy]
+
+    @staticmethod
+    def _bury_batch(cls, pks):
+        using = router.db_for_write(cls)
+        scopes = set()
+
+        with transaction.atomic(using=using):
+            for instance in cls.objects.filter(pk__in=pks, deleted=True):
+                scope = instance.get_change_scope()
+                Tombstone.objects.bury(instance, scope)
+                scopes.add(scope)
+
+            # the objects are not saved, so their changes are tracked here
+            if cls.change_scope:
+                for scope in scopes:
+                    changes.changed(cls, scope, using)
+
+    def _bury_batches(self, cls, options):
+        buried = 0
+
+        while True:
+            pks = list(cls.objects.filter(deleted=True).order_by('pk')
+                       .values_list('pk', flat=True)[:options['batch_size']])
+            if not pks:
+                return buried
+
+            self._bury_batch(cls, pks)
+            buried += len(pks)
+
+            if len(pks) < options['batch_size']:
+                return buried
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+    def handle(self, *args, **options):
+        for cls in self.get_tombstone_models():
+            if options['dry_run']:
+                buried = cls.objects.filter(deleted=True).count()
+            else:
+                buried = self._bury_batches(cls, options)
+
+            self.stdout.write('%s: %d' % (cls._meta.label, buried))
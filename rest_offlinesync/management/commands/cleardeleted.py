@@ -1,34 +1,179 @@
-import datetime
+import time
+import threading
 from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 
+from django.apps import apps
 from django.core.management.base import BaseCommand
-from django.conf import settings
+from django.db import connections
 from django.utils import timezone
 
-from rest_offlinesync.models import TrackedModel
+from rest_offlinesync.conf import get_config
+from rest_offlinesync.models import TrackedModel, Tombstone, ChangeLogEntry
 
 
 class Command(BaseCommand):
+    help = 'Remove deleted objects, whose expiry delay has passed.'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.output_lock = threading.Lock()
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='remove objects in batches of this size, in primary key order')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='seconds to sleep between batches')
+        parser.add_argument('--max-runtime', type=float, default=None,
+                            help='stop after this many seconds; the next invocation resumes the removal')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only count the expired objects')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='number of threads that process independent models concurrently')
+
+    @staticmethod
+    def get_tracked_models():
+        models = [model for model in apps.get_models()
+                  if issubclass(model, TrackedModel) and not model._meta.proxy]
+
+        if any(model.tombstone_storage for model in models):
+            models.append(Tombstone)
+        if any(model.change_log for model in models):
+            models.append(ChangeLogEntry)
+
+        return models
+
+    @staticmethod
+    def get_expired(cls, threshold):
+        if cls is ChangeLogEntry:
+            return cls.objects.filter(created__lt=threshold)
+
+        if cls is Tombstone:
+            return cls.objects.filter(updated__lt=threshold)
+
+        return cls.objects.filter(deleted=True, updated__lt=threshold)
+
+    @staticmethod
+    def group_dependent_models(models):
+        # models, which are related to one another, are processed sequentially to avoid conflicting cascades
+        groups = {model: {model} for model in models}
+
+        for model in models:
+            for field in model._meta.get_fields():
+                related = field.related_model
+                if field.is_relation and related in groups and groups[related] is not groups[model]:
+                    merged = groups[model] | groups[related]
+                    for member in merged:
+                        groups[member] = merged
+
+        unique_groups = []
+        for model in models:
+            if groups[model] not in unique_groups:
+                unique_groups.append(groups[model])
+
+        return [[model for model in models if model in group] for group in unique_groups]
+
+    def _write(self, message, error=False):
+        with self.output_lock:
+            (self.stderr if error else self.stdout).write(message)
+
+    @staticmethod
+    def _add_deletions(deletions, subdeletions):
+        for delcls in subdeletions:
+            if delcls in deletions:
+                deletions[delcls] += subdeletions[delcls]
+
+    def _delete_batches(self, cls, expired, deletions, options, deadline):
+        batch_size = options['batch_size']
+
+        while deadline is None or time.monotonic() < deadline:
+            start = time.monotonic()
+
+            pks = list(expired.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return True
+
+            # each batch is a separate transaction, so an interrupted run leaves no work half done
+            _, subdeletions = cls.objects.filter(pk__in=pks).delete()
+
+            self._add_deletions(deletions, subdeletions)
+
+            if options['verbosity'] >= 2:
+                elapsed = time.monotonic() - start
+                self._write('%s: %d removed (%.0f/s)' % (cls._meta.label, deletions[cls._meta.label],
+                                                         len(pks) / elapsed if elapsed else len(pks)))
+
+            if len(pks) < batch_size:
+                return True
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+        return False
+
+    def clear_models(self, models, deletions, threshold, options, deadline):
+        for cls in models:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+
+            expired = self.get_expired(cls, threshold)
+
+            if options['dry_run']:
+                deletions[cls._meta.label] += expired.count()
+
+            elif options['batch_size']:
+                if not self._delete_batches(cls, expired, deletions, options, deadline):
+                    return False
+
+            else:
+                _, subdeletions = expired.delete()
+
+                self._add_deletions(deletions, subdeletions)
+
+        return True
+
+    def _clear_group(self, models, labels, threshold, options, deadline):
+        deletions = OrderedDict((label, 0) for label in labels)
+
+        try:
+            completed = self.clear_models(models, deletions, threshold, options, deadline)
+
+        finally:
+            # worker threads have their own database connections
+            connections.close_all()
+
+        return deletions, completed
+
     def handle(self, *args, **options):
-        expiry_days = getattr(settings, 'REST_OFFLINESYNC', None) and settings.REST_OFFLINESYNC.get('DELETED_EXPIRY_DAYS')
-        if not expiry_days:
+        expiry = get_config().deleted_expiry
+        if not expiry:
             return
 
-        threshold = timezone.now() - datetime.timedelta(days=expiry_days)
+        threshold = timezone.now() - expiry
+
+        deadline = None
+        if options['max_runtime']:
+            deadline = time.monotonic() + options['max_runtime']
+
+        classes = self.get_tracked_models()
+        deletions = OrderedDict((cls._meta.label, 0) for cls in classes)
 
-        classes = TrackedModel.__subclasses__()
-        deletions = OrderedDict((cls._meta.label, 0) for cls in classes \
-                                if cls._meta.abstract is False and cls._meta.proxy is False)
+        if options['workers'] > 1:
+            with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+                futures = [executor.submit(self._clear_group, group, list(deletions), threshold, options, deadline)
+                           for group in self.group_dependent_models(classes)]
+                results = [future.result() for future in futures]
 
-        for cls in classes:
-            deleted = cls.objects.filter(deleted=True)
-            expired = deleted.filter(updated__lt=threshold)
+        else:
+            completed = self.clear_models(classes, deletions, threshold, options, deadline)
+            results = [(OrderedDict(), completed)]
 
-            _, subdeletions = expired.delete()
+        for group_deletions, completed in results:
+            self._add_deletions(deletions, group_deletions)
 
-            for delcls in subdeletions:
-                if delcls in deletions:
-                    deletions[delcls] += subdeletions[delcls]
+        if not all(completed for _, completed in results):
+            self._write('maximum runtime exceeded', error=True)
 
         for cls in deletions:
-            print('%s: %d' % (cls, deletions[cls]))
+            self.stdout.write('%s: %d' % (cls, deletions[cls]))
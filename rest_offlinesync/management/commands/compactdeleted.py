@@ -0,0 +1,74 @@
+import time
+
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from rest_offlinesync.models import TrackedModel
+
+
+class Command(BaseCommand):
+    help = 'Reset the compacted fields of deleted objects, which were deleted before compaction was enabled.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=None,
+                            help='compact objects in batches of this size, in primary key order')
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='only count the objects to compact')
+
+    @staticmethod
+    def get_compacted_models():
+        return [model for model in apps.get_models()
+                if issubclass(model, TrackedModel) and model.compacted_fields and not model._meta.proxy]
+
+    @staticmethod
+    def get_uncompacted(cls):
+        condition = Q()
+
+        for name in cls.compacted_fields:
+            field = cls._meta.get_field(name)
+            value = field.get_default()
+
+            if value is None:
+                condition |= Q(**{field.attname + '__isnull': False})
+            else:
+                condition |= ~Q(**{field.attname: value})
+                if field.null:
+                    condition |= Q(**{field.attname + '__isnull': True})
+
+        return cls.objects.filter(condition, deleted=True)
+
+    def _compact_batches(self, cls, uncompacted, values, options):
+        batch_size = options['batch_size']
+        compacted = 0
+
+        while True:
+            pks = list(uncompacted.order_by('pk').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return compacted
+
+            # the modification timestamps are left unchanged, since no client reads the compacted fields
+            compacted += cls.objects.filter(pk__in=pks).update(**values)
+
+            if len(pks) < batch_size:
+                return compacted
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+
+    def handle(self, *args, **options):
+        for cls in self.get_compacted_models():
+            uncompacted = self.get_uncompacted(cls)
+
+            if options['dry_run']:
+                compacted = uncompacted.count()
+
+            elif options['batch_size']:
+                compacted = self._compact_batches(cls, uncompacted, cls.get_compacted_values(), options)
+
+            else:
+                compacted = uncompacted.update(**cls.get_compacted_values())
+
+            self.stdout.write('%s: %d' % (cls._meta.label, compacted))
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from rest_offlinesync.conf import get_config
+from rest_offlinesync.models import TrackedModel, ChildCounter
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify the counters of active child objects, used to enforce limits.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--verify', action='store_true', help='only report counters that are out of date')
+
+    def handle(self, *args, **options):
+        verify = options['verify']
+
+        for (parent_model, child_model), limits in get_config().object_limits.items():
+            if not limits[0]:
+                continue
+
+            parent_field = child_model._meta.get_field(parent_model._meta.model_name)
+
+            children = child_model.objects.all()
+            if issubclass(child_model, TrackedModel):
+                children = children.filter(deleted=False)
+
+            with transaction.atomic():
+                actual = children.values(parent_field.attname).annotate(active=Count('*'))
+                actual = {str(row[parent_field.attname]): row['active'] for row in actual}
+
+                counters = ChildCounter.objects.filter(parent_model=parent_model._meta.label,
+                                                       child_model=child_model._meta.label)
+                stored = dict(counters.values_list('parent_key', 'active'))
+
+                stale = {key: actual.get(key, 0) for key in set(actual) | set(stored)
+                         if actual.get(key, 0) != stored.get(key)}
+
+                if not verify:
+                    for key, active in stale.items():
+                        ChildCounter.objects.update_or_create(defaults={'active': active},
+                                                              parent_model=parent_model._meta.label,
+                                                              child_model=child_model._meta.label,
+                                                              parent_key=key)
+
+            self.stdout.write('%s/%s: %d %s' % (parent_model._meta.label, child_model._meta.label, len(stale),
+                                                'stale' if verify else 'rebuilt'))
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 18:47
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_offlinesync', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EvictionWatermark',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('parent_model', models.CharField(max_length=100)),
+                ('child_model', models.CharField(max_length=100)),
+                ('parent_key', models.CharField(max_length=255)),
+                ('evicted', models.DateTimeField()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='evictionwatermark',
+            unique_together=set([('parent_model', 'child_model', 'parent_key')]),
+        ),
+    ]
@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.29 on 2026-10-17 18:59
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rest_offlinesync', '0003_tombstone'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ChangeLogEntry',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('model', models.CharField(max_length=100)),
+                ('object_id', models.CharField(max_length=255)),
+                ('scope', models.CharField(max_length=255, null=True)),
+                ('op', models.CharField(choices=[('create', 'create'), ('update', 'update'), ('delete', 'delete'), ('evict', 'evict')], max_length=8)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=models.Index(fields=['scope', 'id'], name='rest_offlin_scope_3733f7_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='changelogentry',
+            index=models.Index(fields=['created'], name='rest_offlin_created_7fbca4_idx'),
+        ),
+    ]
@@ -1,13 +1,71 @@
+import itertools
+import random
 from collections import OrderedDict
 
+from django.http import StreamingHttpResponse
+from rest_framework import renderers
+
+from . import instrument
+
 
 class ViewSetMixin(object):
+    stream_chunk_size = None
+
+    collector_class = None
+    collector_sample_rate = 1.0
+    server_timing = False
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+
+        self.collector = None
+
+        self.read_db = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        if self.collector_class and random.random() < self.collector_sample_rate:
+            self.collector = self.collector_class(self)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+
+        if self.collector is not None:
+            if self.server_timing:
+                response['Server-Timing'] = self.collector.get_server_timing()
+
+            self.collector.report(request, response)
+
+        return response
+
+    def measure(self, phase):
+        if self.collector is None:
+            return instrument.unmeasured()
+
+        return self.collector.measure(phase)
 
     def get_queryset(self):
+        if self.read_db is not None:
+            return self.queryset.using(self.read_db)
+
         return self.queryset
 
+    def get_change_scope(self):
+        return None
+
+    def check_parent(self):
+        pass
+
+    def prepare_batch(self):
+        pass
+
+    def is_streamed(self):
+        return bool(self.stream_chunk_size)
+
     def decorated_list(self, cls, context, request, *args, **kwargs):
-        response = super(cls, self).list(request, *args, **kwargs)
+        with self.measure('list'):
+            response = super(cls, self).list(request, *args, **kwargs)
 
         if isinstance(response.data, dict):
             base_data = response.data
@@ -20,3 +78,34 @@ class ViewSetMixin(object):
         response.data = data
 
         return response
+
+    def _stream_list(self, context, queryset, renderer):
+        prefix = renderer.render(context)[:-1]
+        if context:
+            prefix += b','
+
+        yield prefix + b'"results":['
+
+        objects = queryset.iterator()
+        separator = b''
+
+        while True:
+            chunk = list(itertools.islice(objects, self.stream_chunk_size))
+            if not chunk:
+                break
+
+            serializer = self.get_serializer(chunk, many=True)
+
+            yield separator + renderer.render(serializer.data)[1:-1]
+            separator = b','
+
+        yield b']}'
+
+    def streamed_list(self, context, request, *args, **kwargs):
+        with self.measure('list'):
+            queryset = self.filter_queryset(self.get_queryset())
+
+        renderer = renderers.JSONRenderer()
+
+        return StreamingHttpResponse(self._stream_list(context, queryset, renderer),
+                                     content_type=renderer.media_type)
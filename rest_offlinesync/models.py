@@ -1,11 +1,218 @@
-from django.db import models
+from django.db import models, router, transaction
+from django.utils import timezone
+
+from .conf import get_config
+
+
+SYNC_INDEX_FIELDS = ['deleted', 'updated', 'id']
+
+
+def sync_indexes(*parent_fields):
+    indexes = [models.Index(fields=SYNC_INDEX_FIELDS)]
+    indexes += [models.Index(fields=[parent_field] + SYNC_INDEX_FIELDS) for parent_field in parent_fields]
+    return indexes
+
+
+class WriteLockedQuerySet(models.QuerySet):
+
+    def _fetch_all(self):
+        # lock the selected rows if the queryset is evaluated in a transaction, e.g. during validation of writes
+        if self._result_cache is None and not self.query.select_for_update and \
+                transaction.get_connection(self.db).in_atomic_block:
+            self.query.select_for_update = True
+
+        super()._fetch_all()
+
+
+def write_locked(queryset):
+    return WriteLockedQuerySet(model=queryset.model, query=queryset.query.clone(),
+                               using=queryset._db, hints=queryset._hints)
+
+
+class TimestampField(models.DateTimeField):
+
+    def pre_save(self, model_instance, add):
+        if self.auto_now or (self.auto_now_add and add):
+            value = get_config().clock.now(getattr(model_instance, self.attname))
+            setattr(model_instance, self.attname, value)
+            return value
+
+        return super().pre_save(model_instance, add)
 
 
 class TrackedModel(models.Model):
     created = models.DateTimeField(auto_now_add=True)
-    updated = models.DateTimeField(auto_now=True)
+    updated = TimestampField(auto_now=True)
 
     deleted = models.BooleanField(default=False)
 
+    change_scope = None
+    compacted_fields = ()
+    tombstone_storage = False
+    change_log = False
+
     class Meta:
         abstract = True
+        indexes = sync_indexes()
+
+    def get_change_scope(self):
+        return getattr(self, self.change_scope) if self.change_scope else None
+
+    def save(self, *args, **kwargs):
+        if not self.change_log:
+            return super().save(*args, **kwargs)
+
+        if self.deleted:
+            op = ChangeLogEntry.DELETE
+        elif self._state.adding:
+            op = ChangeLogEntry.CREATE
+        else:
+            op = ChangeLogEntry.UPDATE
+
+        using = kwargs.get('using') or router.db_for_write(type(self), instance=self)
+
+        # the change is logged in the same transaction
+        with transaction.atomic(using=using, savepoint=False):
+            super().save(*args, **kwargs)
+
+            ChangeLogEntry.objects.append(type(self), [self.pk], self.get_change_scope(), op, using)
+
+    @classmethod
+    def get_compacted_values(cls):
+        fields = [cls._meta.get_field(name) for name in cls.compacted_fields]
+        return {field.attname: field.get_default() for field in fields}
+
+    def compact(self):
+        for attname, value in self.get_compacted_values().items():
+            setattr(self, attname, value)
+
+
+class ChildCounterManager(models.Manager):
+
+    @staticmethod
+    def _get_filter_kwargs(parent_model, child_model, parent_key):
+        return dict(parent_model=parent_model._meta.label, child_model=child_model._meta.label,
+                    parent_key=str(parent_key))
+
+    def get_active(self, parent_model, child_model, parent_key, count):
+        filter_kwargs = self._get_filter_kwargs(parent_model, child_model, parent_key)
+
+        counter, _ = self.get_or_create(defaults={'active': count}, **filter_kwargs)
+
+        return counter.active
+
+    def adjust(self, parent_model, child_model, parent_key, delta, count):
+        filter_kwargs = self._get_filter_kwargs(parent_model, child_model, parent_key)
+
+        if self.filter(**filter_kwargs).update(active=models.F('active') + delta):
+            return
+
+        # the initial count already includes this change, unless a concurrent transaction created the counter first
+        _, created = self.get_or_create(defaults={'active': count}, **filter_kwargs)
+
+        if not created:
+            self.filter(**filter_kwargs).update(active=models.F('active') + delta)
+
+
+class ChildCounter(models.Model):
+    parent_model = models.CharField(max_length=100)
+    child_model = models.CharField(max_length=100)
+    parent_key = models.CharField(max_length=255)
+
+    active = models.IntegerField()
+
+    objects = ChildCounterManager()
+
+    class Meta:
+        unique_together = (('parent_model', 'child_model', 'parent_key'),)
+
+
+class EvictionWatermarkManager(models.Manager):
+
+    def raise_to(self, parent_model, child_model, parent_key, timestamp):
+        filter_kwargs = dict(parent_model=parent_model._meta.label, child_model=child_model._meta.label,
+                             parent_key=str(parent_key))
+
+        _, created = self.get_or_create(defaults={'evicted': timestamp}, **filter_kwargs)
+
+        if not created:
+            self.filter(evicted__lt=timestamp, **filter_kwargs).update(evicted=timestamp)
+
+
+class EvictionWatermark(models.Model):
+    parent_model = models.CharField(max_length=100)
+    child_model = models.CharField(max_length=100)
+    parent_key = models.CharField(max_length=255)
+
+    evicted = models.DateTimeField()
+
+    objects = EvictionWatermarkManager()
+
+    class Meta:
+        unique_together = (('parent_model', 'child_model', 'parent_key'),)
+
+
+class TombstoneManager(models.Manager):
+
+    def bury(self, instance, scope):
+        using = router.db_for_write(type(instance), instance=instance)
+
+        with transaction.atomic(using=using, savepoint=False):
+            tombstone = self.create(model=instance._meta.label, object_id=str(instance.pk),
+                                    scope=None if scope is None else str(scope),
+                                    updated=get_config().clock.now(instance.updated))
+
+            if instance.change_log:
+                ChangeLogEntry.objects.append(type(instance), [instance.pk], scope, ChangeLogEntry.DELETE, using)
+
+            instance.delete()
+
+        return tombstone
+
+
+class Tombstone(models.Model):
+    model = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255, null=True)
+
+    updated = models.DateTimeField()
+
+    objects = TombstoneManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['model', 'scope', 'updated', 'id']),
+                   models.Index(fields=['updated'])]
+
+
+class ChangeLogEntryManager(models.Manager):
+
+    def append(self, model, object_ids, scope, op, using=None):
+        entries = [self.model(model=model._meta.label, object_id=str(object_id),
+                              scope=None if scope is None else str(scope), op=op)
+                   for object_id in object_ids]
+
+        self.db_manager(using).bulk_create(entries)
+
+
+class ChangeLogEntry(models.Model):
+    CREATE = 'create'
+    UPDATE = 'update'
+    DELETE = 'delete'
+    EVICT = 'evict'
+
+    OPS = ((CREATE, 'create'), (UPDATE, 'update'), (DELETE, 'delete'), (EVICT, 'evict'))
+
+    id = models.BigAutoField(primary_key=True)
+
+    model = models.CharField(max_length=100)
+    object_id = models.CharField(max_length=255)
+    scope = models.CharField(max_length=255, null=True)
+    op = models.CharField(max_length=8, choices=OPS)
+
+    created = models.DateTimeField(default=timezone.now)
+
+    objects = ChangeLogEntryManager()
+
+    class Meta:
+        indexes = [models.Index(fields=['scope', 'id']),
+                   models.Index(fields=['created'])]
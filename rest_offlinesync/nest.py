@@ -1,16 +1,126 @@
-from django.db import transaction
+import hashlib
+
+from django.core.cache import cache
+from django.core.exceptions import EmptyResultSet, FieldDoesNotExist
+from django.db import connections, models, transaction
+from django.db.models.query import ModelIterable, ValuesIterable
+from django.http import Http404
 from django.shortcuts import get_object_or_404
 from rest_framework import exceptions
 
-from .models import TrackedModel
+from .models import TrackedModel, Tombstone
 from .mixin import ViewSetMixin
 
 
+class ParentCheckedQuerySet(models.QuerySet):
+    parent_queryset = None
+    parent_check = None
+
+    def _clone(self, **kwargs):
+        kwargs.setdefault('parent_queryset', self.parent_queryset)
+        kwargs.setdefault('parent_check', self.parent_check)
+        return super()._clone(**kwargs)
+
+    def _get_ordering_columns(self):
+        opts = self.model._meta
+        ordering = self.query.order_by or (opts.ordering if self.query.default_ordering else ())
+
+        columns = []
+        for name in ordering:
+            if not isinstance(name, str):
+                return None
+
+            try:
+                field = opts.pk if name.lstrip('-') == 'pk' else opts.get_field(name.lstrip('-'))
+            except FieldDoesNotExist:
+                return None
+
+            if not field.concrete:
+                return None
+
+            columns.append((field.column, name.startswith('-')))
+
+        return columns
+
+    def _get_names(self, compiler):
+        if self._iterable_class is ValuesIterable:
+            return list(self.query.values_select)
+
+        return [col.target.attname for col, _, _ in compiler.select]
+
+    def _fetch_with_parent(self):
+        query = self.query
+        if self._iterable_class not in (ModelIterable, ValuesIterable) or query.select_related or \
+                query.annotation_select or query.extra_select or self._known_related_objects or \
+                self.model._meta.parents:
+            return None
+
+        columns = self._get_ordering_columns()
+        if columns is None:
+            return None
+
+        compiler = query.get_compiler(using=self.db)
+        try:
+            sql, params = compiler.as_sql()
+        except EmptyResultSet:
+            return None
+
+        names = self._get_names(compiler)
+        pk_names = ('pk', self.model._meta.pk.name, self.model._meta.pk.attname)
+        pk_index = next((i for i, name in enumerate(names) if name in pk_names), None)
+        if pk_index is None:
+            return None
+
+        parent_sql, parent_params = self.parent_queryset.values('pk')[:1].query.get_compiler(using=self.db).as_sql()
+
+        connection = connections[self.db]
+        qn = connection.ops.quote_name
+
+        # the parent is outer joined to the rows, so that it yields a row of nulls if it exists without any rows
+        sql = 'SELECT %s.* FROM (%s) %s LEFT OUTER JOIN (%s) %s ON 1 = 1' % \
+              (qn('child'), parent_sql, qn('parent'), sql, qn('child'))
+        if columns:
+            sql += ' ORDER BY ' + ', '.join('%s.%s %s' % (qn('child'), qn(column), 'DESC' if descending else 'ASC')
+                                            for column, descending in columns)
+
+        with connection.cursor() as cursor:
+            cursor.execute(sql, tuple(parent_params) + tuple(params))
+            rows = cursor.fetchall()
+
+        self.parent_check['exists'] = bool(rows)
+
+        rows = [row for row in compiler.results_iter([rows]) if row[pk_index] is not None]
+
+        if self._iterable_class is ValuesIterable:
+            return [dict(zip(names, row)) for row in rows]
+
+        return [self.model.from_db(self.db, names, row) for row in rows]
+
+    def _fetch_all(self):
+        if self._result_cache is None and self.parent_queryset is not None:
+            self._result_cache = self._fetch_with_parent()
+
+        super()._fetch_all()
+
+
+def parent_checked(queryset, parent_queryset, parent_check):
+    checked = ParentCheckedQuerySet(model=queryset.model, query=queryset.query.clone(),
+                                    using=queryset._db, hints=queryset._hints)
+    checked._prefetch_related_lookups = queryset._prefetch_related_lookups
+    checked.parent_queryset = parent_queryset
+    checked.parent_check = parent_check
+
+    return checked
+
+
 class NestedModelMixin(ViewSetMixin):
 
     parent_model = None
     parent_path_model = None
     safe_parent_path = False
+    deferred_parent_check = False
+    parent_cache_timeout = None
+    parent_locked_on_write = False
 
     object_filters = {}
     parent_filters = {}
@@ -20,6 +130,9 @@ class NestedModelMixin(ViewSetMixin):
         super().__init__(*args, **kwargs)
 
         self.deleted_parent = False
+        self.parent_check = None
+
+        self.batch_parent = None
 
     def get_parent_name(self):
         return self.parent_model._meta.model_name
@@ -54,42 +167,122 @@ class NestedModelMixin(ViewSetMixin):
 
         if lock:
             queryset = queryset.select_for_update()
+        elif self.read_db is not None:
+            queryset = queryset.using(self.read_db)
 
         return queryset
 
     def get_parent(self, path, lock):
-        queryset = self.get_parent_queryset(path, lock)
+        if lock and not path and self.batch_parent is not None:
+            return self.batch_parent
+
+        with self.measure('lock' if lock else 'parent'):
+            queryset = self.get_parent_queryset(path, lock)
 
-        parent = get_object_or_404(queryset)
+            parent = get_object_or_404(queryset)
 
         return parent
 
     def get_queryset(self):
         queryset = super().get_queryset()
 
+        # tombstones are filtered by their change scope instead
+        if queryset.model is Tombstone:
+            return queryset
+
         queryset = self._filter_queryset(queryset, self.object_filters, False)
 
+        if self.parent_check is not None:
+            queryset = parent_checked(queryset, self.get_parent_queryset(True, False), self.parent_check)
+
         return queryset
 
+    def get_change_scope(self):
+        kwarg = self.object_filters.get(self.queryset.model.change_scope)
+        if kwarg is None:
+            return super().get_change_scope()
+
+        return self.kwargs[kwarg]
+
+    def _get_parent_cache_key(self):
+        filters = self.parent_path_filters if self.is_aggregate() else self.parent_filters
+        filter_values = sorted((expr, str(self.kwargs[kwarg])) for expr, kwarg in filters.items())
+
+        digest = hashlib.md5(repr(filter_values).encode()).hexdigest()
+
+        return 'rest_offlinesync:parent:%s:%s' % (self.parent_path_model._meta.label, digest)
+
+    def check_parent(self):
+        if self.safe_parent_path:
+            return
+
+        cache_key = None
+
+        if self.parent_cache_timeout:
+            cache_key = self._get_parent_cache_key()
+            if cache.get(cache_key):
+                return
+
+        self.get_parent(True, False)
+
+        if cache_key:
+            cache.set(cache_key, True, self.parent_cache_timeout)
+
     def list(self, request, *args, **kwargs):
-        if not self.safe_parent_path:
-            self.get_parent(True, False)
+        if self.safe_parent_path:
+            return super().list(request, *args, **kwargs)
+
+        if not self.deferred_parent_check or self.is_aggregate() or self.is_streamed():
+            self.check_parent()
 
-        return super().list(request, *args, **kwargs)
+            return super().list(request, *args, **kwargs)
+
+        # the parent of a non-aggregate viewset is joined to the query of its children,
+        # so the parent is only checked separately if the children were not queried
+        self.parent_check = {}
+        try:
+            response = super().list(request, *args, **kwargs)
+        finally:
+            parent_check, self.parent_check = self.parent_check, None
+
+        data = getattr(response, 'data', None)
+        results = data.get('results') if isinstance(data, dict) else data
+
+        if not results:
+            if 'exists' not in parent_check:
+                self.check_parent()
+            elif not parent_check['exists']:
+                raise Http404
+
+        return response
 
     def locked_parent(self, parent):
         queryset = self.parent_model.objects.select_for_update()
 
         try:
-            locked = queryset.get(pk=parent.pk)
+            with self.measure('lock'):
+                locked = queryset.get(pk=parent.pk)
 
         except self.parent_model.DoesNotExist:
             raise exceptions.APIException({self.get_parent_name(): "object no longer exists"})
 
         return locked
 
+    def get_validated_parent(self, serializer):
+        parent = serializer.validated_data[self.get_parent_name()]
+
+        if self.parent_locked_on_write:
+            return parent
+
+        return self.locked_parent(parent)
+
     def create(self, request, *args, **kwargs):
         self.deleted_parent = None
+
+        if self.parent_locked_on_write:
+            with transaction.atomic(savepoint=False):
+                return super().create(request, *args, **kwargs)
+
         return super().create(request, *args, **kwargs)
 
     def update(self, request, *args, **kwargs):
@@ -100,6 +293,15 @@ class NestedModelMixin(ViewSetMixin):
         self.deleted_parent = None
         return super().destroy(request, *args, **kwargs)
 
+    def prepare_batch(self):
+        super().prepare_batch()
+
+        self.deleted_parent = None
+
+        if not self.is_aggregate():
+            # lock the parent once, outside of the savepoints of the individual operations
+            self.batch_parent = self.get_parent(False, True)
+
     @transaction.atomic(savepoint=False)
     def perform_create(self, serializer):
         parent_name = self.get_parent_name()
@@ -107,20 +309,12 @@ class NestedModelMixin(ViewSetMixin):
         save_kwargs = {}
 
         if self.is_aggregate():
-            # TODO: This lock should ideally be optimized away to save a database query.
-            # To accomplish this:
-            #  - the parent should be locked when its queryset is evaluated and validated
-            #  - the transaction block should be moved to create()
-            #  - this branch should be removed
-            #  - the documentation should warn that locking of the parent is a responsibility of the library's client
-            # However, the parent queryset is evaluated also during list requests, which handled without a transaction.
-            # This causes internal server errors when trying to lock the queryset with select_for_update().
-            # Another problem is that the parent set may have been created at initialization time,
-            # outside of a transaction.
+            # Unless the serializer locked the parent when validating it (see parent_locked_on_write),
+            # it is locked here, at the cost of an additional query.
             # It's preferable to lock the parent instead of catching constraint violations because the latter:
             #  - is not applicable to the limit subclass, where the parent really needs to be locked for isolation
             #  - involves a second possibility of error within the same request
-            self.locked_parent(serializer.validated_data[parent_name])
+            self.get_validated_parent(serializer)
 
         else:
             parent = self.get_parent(False, True)
@@ -0,0 +1,113 @@
+import select
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.dispatch import receiver
+
+from .changes import scope_changed
+from .conf import get_config
+
+
+class LocalNotifier(object):
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.waiters = {}
+
+    @staticmethod
+    def get_channel(model, scope):
+        return '%s:%s' % (model._meta.label, scope)
+
+    @contextmanager
+    def subscribe(self, model, scope):
+        channel = self.get_channel(model, scope)
+        event = threading.Event()
+
+        with self.lock:
+            self.waiters.setdefault(channel, set()).add(event)
+
+        try:
+            yield event
+
+        finally:
+            with self.lock:
+                events = self.waiters[channel]
+                events.discard(event)
+                if not events:
+                    del self.waiters[channel]
+
+    def wake(self, channel):
+        with self.lock:
+            for event in self.waiters.get(channel, ()):
+                event.set()
+
+    def publish(self, model, scope):
+        self.wake(self.get_channel(model, scope))
+
+
+class PostgresNotifier(LocalNotifier):
+    channel_name = 'rest_offlinesync'
+    reconnect_delay = 1
+    poll_interval = 60
+
+    def __init__(self, using=DEFAULT_DB_ALIAS):
+        super().__init__()
+
+        self.using = using
+        self.listener = None
+
+    @contextmanager
+    def subscribe(self, model, scope):
+        self._start_listener()
+
+        with super().subscribe(model, scope) as event:
+            yield event
+
+    def publish(self, model, scope):
+        with connections[self.using].cursor() as cursor:
+            cursor.execute('SELECT pg_notify(%s, %s)', [self.channel_name, self.get_channel(model, scope)])
+
+    def _start_listener(self):
+        with self.lock:
+            if self.listener is None or not self.listener.is_alive():
+                self.listener = threading.Thread(target=self._listen, name='rest_offlinesync-listener', daemon=True)
+                self.listener.start()
+
+    def _listen(self):
+        wrapper = connections[self.using]
+
+        while True:
+            try:
+                # a dedicated connection, since Django's connections are not shared between threads
+                connection = wrapper.get_new_connection(wrapper.get_connection_params())
+
+            except Exception:
+                time.sleep(self.reconnect_delay)
+                continue
+
+            try:
+                connection.autocommit = True
+
+                with connection.cursor() as cursor:
+                    cursor.execute('LISTEN %s' % self.channel_name)
+
+                while True:
+                    select.select([connection], [], [], self.poll_interval)
+
+                    connection.poll()
+
+                    while connection.notifies:
+                        self.wake(connection.notifies.pop(0).payload)
+
+            except Exception:
+                time.sleep(self.reconnect_delay)
+
+            finally:
+                connection.close()
+
+
+@receiver(scope_changed)
+def publish_change(sender, scope, **kwargs):
+    get_config().notifier.publish(sender, scope)
@@ -0,0 +1,100 @@
+from base64 import b64decode, b64encode
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from django.utils import dateparse
+from django.utils.six.moves.urllib import parse as urlparse
+from rest_framework import pagination
+from rest_framework.exceptions import NotFound
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class SyncCursorPagination(pagination.BasePagination):
+    cursor_query_param = 'cursor'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Invalid cursor'
+
+    ordering = ('updated', 'id')
+
+    def __init__(self):
+        self.base_url = None
+        self.next_position = None
+
+    @staticmethod
+    def _get_position(instance):
+        if isinstance(instance, dict):
+            return instance['updated'], instance['id']
+
+        return instance.updated, instance.id
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+
+        try:
+            querystring = b64decode(encoded.encode('ascii')).decode('ascii')
+            tokens = urlparse.parse_qs(querystring, keep_blank_values=True)
+
+            updated = dateparse.parse_datetime(tokens['u'][0])
+            id = tokens['i'][0]
+        except (TypeError, ValueError, KeyError):
+            raise NotFound(self.invalid_cursor_message)
+
+        if updated is None or updated.tzinfo is None:
+            raise NotFound(self.invalid_cursor_message)
+
+        return updated, id
+
+    def encode_cursor(self, position):
+        updated, id = position
+
+        querystring = urlparse.urlencode(OrderedDict((('u', updated.isoformat()), ('i', str(id)))))
+
+        return b64encode(querystring.encode('ascii')).decode('ascii')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if not self.page_size:
+            return None
+
+        self.base_url = request.build_absolute_uri()
+
+        # freeze the upper bound of the window, so that objects modified while paging are left for the next sync
+        until = getattr(view, 'until', None)
+        if until is not None:
+            self.base_url = replace_query_param(self.base_url, view.until_param, until.isoformat())
+
+        queryset = queryset.order_by(*self.ordering)
+
+        position = self.decode_cursor(request)
+        if position is not None:
+            updated, id = position
+
+            try:
+                id = queryset.model._meta.pk.to_python(id)
+            except ValidationError:
+                raise NotFound(self.invalid_cursor_message)
+
+            queryset = queryset.filter(Q(updated__gt=updated) | Q(updated=updated, id__gt=id))
+
+        results = list(queryset[:self.page_size + 1])
+
+        page = results[:self.page_size]
+
+        if len(results) > self.page_size:
+            self.next_position = self._get_position(page[-1])
+
+        return page
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+
+        return replace_query_param(self.base_url, self.cursor_query_param, self.encode_cursor(self.next_position))
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict((('next', self.get_next_link()),
+                                     ('results', data))))
@@ -0,0 +1,58 @@
+import datetime
+
+from django.db import connections
+from django.utils import timezone
+
+from .conf import get_config
+
+
+REPLAY_TIMESTAMP_QUERIES = {
+    # the commit time of the last replayed transaction; changes still in transit from the primary are not known
+    'postgresql': "SELECT pg_last_xact_replay_timestamp()",
+}
+
+
+def get_replay_timestamp(using):
+    connection = connections[using]
+
+    if connection.vendor == 'mysql':
+        with connection.cursor() as cursor:
+            cursor.execute('SHOW SLAVE STATUS')
+            row = cursor.fetchone()
+            if row is None:
+                return None
+
+            status = dict(zip((column[0] for column in cursor.description), row))
+
+        lag = status.get('Seconds_Behind_Master')
+        if lag is None:
+            return None
+
+        return timezone.now() - datetime.timedelta(seconds=lag)
+
+    query = REPLAY_TIMESTAMP_QUERIES.get(connection.vendor)
+    if query is None:
+        return timezone.now()
+
+    with connection.cursor() as cursor:
+        cursor.execute(query)
+        timestamp, = cursor.fetchone()
+
+    return timestamp
+
+
+def get_read_replica():
+    config = get_config()
+
+    if config.read_replica is None:
+        return None, None
+
+    replayed = config.replay_timestamp(config.read_replica)
+
+    # replicas that are not replicating, or lag too far behind, are not used
+    if replayed is None:
+        return None, None
+    if config.max_replica_lag is not None and timezone.now() - replayed > config.max_replica_lag:
+        return None, None
+
+    return config.read_replica, replayed
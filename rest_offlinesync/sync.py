@@ -1,18 +1,43 @@
-import time
+import copy
 import datetime
+import hashlib
 from collections import OrderedDict
 
-from django.conf import settings
+from django.core.exceptions import PermissionDenied
 from django.db import transaction
+from django.db.models import Count, Max
+from django.http import Http404, QueryDict
 from django.utils import timezone, dateparse
-from rest_framework import exceptions, status, decorators
+from django.utils.http import parse_etags
+from rest_framework import exceptions, status, decorators, mixins
+from rest_framework.request import clone_request
+from rest_framework.response import Response
 
+from . import changes, clock, replica
+from .conf import get_config
 from .delete import DeletableModelMixin
 
 
 DEFAULT_AT_PARAM = 'at'
 DEFAULT_SINCE_PARAM = 'since'
 DEFAULT_UNTIL_PARAM = 'until'
+DEFAULT_TIMEOUT_PARAM = 'timeout'
+
+REPLICA_ACTIONS = ('list', 'deleted')
+
+BATCH_ACTIONS = {
+    'create': 'POST',
+    'update': 'PUT',
+    'partial_update': 'PATCH',
+    'destroy': 'DELETE',
+}
+
+BATCH_MIXINS = {
+    'create': mixins.CreateModelMixin,
+    'update': mixins.UpdateModelMixin,
+    'partial_update': mixins.UpdateModelMixin,
+    'destroy': mixins.DestroyModelMixin,
+}
 
 
 class ConflictError(exceptions.APIException):
@@ -25,6 +50,14 @@ class SyncedModelMixin(DeletableModelMixin):
     since_param = DEFAULT_SINCE_PARAM
     until_param = DEFAULT_UNTIL_PARAM
 
+    conditional_list = False
+
+    consistent_reads = False
+    consistency_margin = datetime.timedelta(seconds=1)
+
+    timeout_param = DEFAULT_TIMEOUT_PARAM
+    wait_timeout = 30
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
@@ -35,6 +68,10 @@ class SyncedModelMixin(DeletableModelMixin):
 
         self.isolated = False
 
+        self.unchanged = False
+
+        self.replayed = None
+
     @staticmethod
     def get_timestamp(request, name, default=None):
         timestamp_reprs = request.query_params.getlist(name)
@@ -54,15 +91,35 @@ class SyncedModelMixin(DeletableModelMixin):
 
         return timestamp
 
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+
+        if self.action in REPLICA_ACTIONS and get_config().read_replica is not None:
+            with self.measure('replica'):
+                self.read_db, self.replayed = replica.get_read_replica()
+
+    def get_default_until(self):
+        if self.consistent_reads:
+            until = clock.safe_now(self.consistency_margin, self.queryset.db)
+        else:
+            until = timezone.now()
+
+        # objects that the replica has not replayed yet are left for the next sync
+        if self.replayed is not None:
+            replayed = self.replayed - self.consistency_margin if self.consistent_reads else self.replayed
+            until = min(until, replayed)
+
+        return until
+
     def _is_expired(self):
-        expiry_days = getattr(settings, 'REST_OFFLINESYNC', None) and settings.REST_OFFLINESYNC.get('DELETED_EXPIRY_DAYS')
-        if not expiry_days:
+        expiry = get_config().deleted_expiry
+        if not expiry:
             return False
 
         if self.since is None:
             return True
 
-        return self.since < (timezone.now() - datetime.timedelta(expiry_days))
+        return self.since < (timezone.now() - expiry)
 
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -75,16 +132,75 @@ class SyncedModelMixin(DeletableModelMixin):
         if self.isolated:
             queryset = queryset.select_for_update()
 
+        if self.unchanged:
+            queryset = queryset.none()
+
         return queryset
 
+    def _is_unchanged(self):
+        scope = self.get_change_scope()
+        if self.since is None or scope is None:
+            return False
+
+        model = self.queryset.model
+
+        querysets = [self.queryset.filter(**{model.change_scope: scope})]
+        if self.uses_tombstones():
+            querysets.append(self.get_tombstone_queryset())
+
+        def get_version():
+            versions = [queryset.aggregate(updated=Max('updated'))['updated'] for queryset in querysets]
+            return max((version for version in versions if version is not None), default=None)
+
+        with self.measure('changes'):
+            return changes.is_unchanged(model, scope, self.since, get_version)
+
+    def get_list_etag(self, request):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        # every change within the scope increases the maximum timestamp, except for removals, which decrease the count
+        version = queryset.aggregate(count=Count('pk'), updated=Max('updated'))
+
+        expired = self.deleted_object and self._is_expired()
+
+        key = (request.path, sorted(request.query_params.lists()), version['count'] or 0, version['updated'], expired)
+
+        return '"%s"' % hashlib.md5(repr(key).encode()).hexdigest()
+
     def list(self, request, *args, **kwargs):
         self.since = self.get_timestamp(request, self.since_param)
-        self.until = self.get_timestamp(request, self.until_param, timezone.now())
+        self.until = self.get_timestamp(request, self.until_param, self.get_default_until())
+
+        # e.g. later pages, whose until was taken from a replica that is ahead of this one
+        if self.replayed is not None and self.until > self.replayed:
+            self.read_db = None
+
+        self.unchanged = self._is_unchanged()
+
+        etag = None
+
+        if self.conditional_list:
+            with self.measure('version'):
+                etag = self.get_list_etag(request)
+
+            if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+                response = Response(status=status.HTTP_304_NOT_MODIFIED)
+                response['ETag'] = etag
+                return response
 
         context = OrderedDict(((self.since_param, self.since),
                                (self.until_param, self.until)))
 
-        return self.decorated_list(SyncedModelMixin, context, request, *args, **kwargs)
+        if self.is_streamed():
+            response = self.streamed_list(context, request, *args, **kwargs)
+
+        else:
+            response = self.decorated_list(SyncedModelMixin, context, request, *args, **kwargs)
+
+        if etag is not None:
+            response['ETag'] = etag
+
+        return response
 
     @decorators.list_route(suffix='Archive')
     def deleted(self, request, *args, **kwargs):
@@ -96,18 +212,52 @@ class SyncedModelMixin(DeletableModelMixin):
 
         return response
 
-    @staticmethod
-    def _ensure_updated_past(instance):
-        while True:
-            now = timezone.now()
+    def _get_wait_timeout(self, request):
+        timeout_repr = request.query_params.get(self.timeout_param)
+        if timeout_repr is None:
+            return self.wait_timeout
+
+        try:
+            timeout = float(timeout_repr)
+        except ValueError:
+            raise exceptions.ValidationError({self.timeout_param: 'invalid timeout'})
 
-            if instance.updated < now:
-                break
+        if timeout < 0:
+            raise exceptions.ValidationError({self.timeout_param: 'negative timeout'})
 
-            if instance.updated > now:
-                raise ValueError('updated timestamp is in the future')
+        return min(timeout, self.wait_timeout)
 
-            time.sleep(0.001)
+    @decorators.list_route(suffix='Wait')
+    def wait(self, request, *args, **kwargs):
+        scope = self.get_change_scope()
+        if scope is None:
+            raise exceptions.NotFound('change notifications are not available')
+
+        self.check_parent()
+
+        self.since = self.get_timestamp(request, self.since_param)
+        timeout = self._get_wait_timeout(request)
+
+        self.deleted_object = None
+
+        # subscribe before checking for changes, so that none are missed in between
+        with get_config().notifier.subscribe(self.queryset.model, scope) as changed:
+            if self.since is None:
+                changed.set()
+
+            else:
+                self.unchanged = self._is_unchanged()
+
+                if self.get_queryset().exists():
+                    changed.set()
+
+                elif self.uses_tombstones() and not self.unchanged and \
+                        self.get_tombstone_queryset().filter(updated__gte=self.since).exists():
+                    changed.set()
+
+            changed.wait(timeout)
+
+        return Response(OrderedDict(changed=changed.is_set()))
 
     def _init_write_conditions(self, request):
         unsupported_conditions = [param for param in request.query_params
@@ -140,13 +290,84 @@ class SyncedModelMixin(DeletableModelMixin):
     def perform_update(self, serializer):
         self._check_write_conditions(serializer.instance)
 
-        self._ensure_updated_past(serializer.instance)
-
         serializer.save()
 
     def perform_destroy(self, instance):
         self._check_write_conditions(instance)
 
-        self._ensure_updated_past(instance)
-
         super().perform_destroy(instance)
+
+    def _get_operation_request(self, request, operation):
+        method = BATCH_ACTIONS[operation['op']]
+
+        op_request = clone_request(request, method)
+
+        op_request._request = copy.copy(request._request)
+        op_request._request.GET = QueryDict(mutable=True)
+        if operation.get('at') is not None:
+            op_request._request.GET[self.at_param] = operation['at']
+
+        op_request._full_data = operation.get('data', {})
+
+        return op_request
+
+    def _perform_operation(self, request, operation):
+        if not isinstance(operation, dict) or operation.get('op') not in BATCH_ACTIONS:
+            raise exceptions.ValidationError({'op': 'unsupported operation'})
+
+        action = operation['op']
+
+        # the mixins of this package override the actions, which the viewset may not implement
+        method = BATCH_ACTIONS[action]
+        if not isinstance(self, BATCH_MIXINS[action]) or method.lower() not in self.http_method_names:
+            raise exceptions.MethodNotAllowed(method)
+
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        kwargs = self.kwargs.copy()
+
+        if action != 'create':
+            if operation.get('id') is None:
+                raise exceptions.ValidationError({'id': 'this field is required'})
+
+            kwargs[lookup_url_kwarg] = operation['id']
+
+        op_request = self._get_operation_request(request, operation)
+
+        handler = getattr(self, action)
+
+        saved_request, saved_action, saved_kwargs = self.request, self.action, self.kwargs
+        self.request, self.action, self.kwargs = op_request, action, kwargs
+
+        try:
+            # permissions may depend on the method, and object permissions are checked against self.request
+            self.check_permissions(op_request)
+
+            return handler(op_request, **kwargs)
+
+        finally:
+            self.request, self.action, self.kwargs = saved_request, saved_action, saved_kwargs
+
+    @decorators.list_route(methods=['post'], suffix='Batch')
+    @transaction.atomic(savepoint=False)
+    def batch(self, request, *args, **kwargs):
+        operations = request.data
+        if not isinstance(operations, list):
+            raise exceptions.ValidationError('expected a list of operations')
+
+        self.prepare_batch()
+
+        results = []
+
+        for operation in operations:
+            with transaction.atomic():
+                try:
+                    response = self._perform_operation(request, operation)
+
+                except (exceptions.APIException, Http404, PermissionDenied) as exc:
+                    response = self.handle_exception(exc)
+                    transaction.set_rollback(True)
+
+            results.append(OrderedDict((('status', response.status_code),
+                                        ('data', response.data))))
+
+        return Response(results)